@@ -0,0 +1,305 @@
+"""
+A local stand-in for the parts of the Airtable API used by the exporter,
+serving a synthetic base of any size.
+
+Records are generated when each page is requested, from a seed based on the
+record's position, so the same base is served every time and the server
+doesn't hold the whole base in memory (which would count towards the peak
+memory use of the benchmark).
+"""
+
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+PAGE_SIZE = 100
+BASE_ID = "appBenchmark0000"
+
+# the field types that are generated by default, covering each way that
+# values are stored
+FIELD_TYPES = (
+    "singleLineText",
+    "multilineText",
+    "number",
+    "checkbox",
+    "singleSelect",
+    "multipleSelects",
+    "date",
+    "dateTime",
+    "multipleAttachments",
+    "multipleRecordLinks",
+)
+SELECT_CHOICES = ("Red", "Orange", "Yellow", "Green", "Blue", "Indigo", "Violet")
+
+
+@dataclass
+class BaseSpec:
+    """
+    The size and shape of a synthetic base. Each table has `fields_per_type`
+    fields of each type in `field_types`, and `records` records. Each link
+    field links to the next table, with `link_density` linked records per
+    record on average.
+    """
+
+    tables: int = 5
+    records: int = 1000
+    fields_per_type: int = 1
+    link_density: float = 1.0
+    field_types: Tuple[str, ...] = FIELD_TYPES
+    seed: int = 0
+
+    @property
+    def total_records(self) -> int:
+        return self.tables * self.records
+
+
+def table_id(table: int) -> str:
+    return f"tbl{table:014d}"
+
+
+def field_id(table: int, field: int) -> str:
+    return f"fld{table:04d}{field:010d}"
+
+
+def record_id(table: int, record: int) -> str:
+    return f"rec{table:04d}{record:010d}"
+
+
+def choice_id(choice: int) -> str:
+    return f"sel{choice:014d}"
+
+
+class FakeBase:
+    def __init__(self, spec: BaseSpec, base_id: str = BASE_ID, name: str = "Benchmark") -> None:
+        self.spec = spec
+        self.id = base_id
+        self.name = name
+        self.tables = [self.table_schema(table) for table in range(spec.tables)]
+        self.table_index = {schema["id"]: table for table, schema in enumerate(self.tables)}
+
+    def table_schema(self, table: int) -> Dict[str, Any]:
+        fields: List[Dict[str, Any]] = [
+            {"id": field_id(table, 0), "name": "Name", "type": "singleLineText"},
+        ]
+        for field_type in self.spec.field_types:
+            for number in range(self.spec.fields_per_type):
+                field: Dict[str, Any] = {
+                    "id": field_id(table, len(fields)),
+                    "name": f"{field_type} {number + 1}",
+                    "type": field_type,
+                }
+                if field_type in ("singleSelect", "multipleSelects"):
+                    field["options"] = {
+                        "choices": [
+                            {"id": choice_id(choice), "name": name, "color": "blueLight2"}
+                            for choice, name in enumerate(SELECT_CHOICES)
+                        ]
+                    }
+                elif field_type == "multipleRecordLinks":
+                    field["options"] = {"linkedTableId": table_id((table + 1) % self.spec.tables)}
+                fields.append(field)
+        return {
+            "id": table_id(table),
+            "name": f"Table {table + 1}",
+            "primaryFieldId": fields[0]["id"],
+            "fields": fields,
+            "views": [{"id": f"viw{table:014d}", "name": "Grid view", "type": "grid"}],
+        }
+
+    def field_value(self, rng: random.Random, table: int, record: int, field: Dict[str, Any]) -> Any:
+        field_type = field["type"]
+        if field_type == "singleLineText":
+            return f"Record {record + 1}"
+        if field_type == "multilineText":
+            return " ".join(rng.choice(SELECT_CHOICES) for _ in range(rng.randint(5, 50)))
+        if field_type == "number":
+            return round(rng.uniform(0, 10000), 2)
+        if field_type == "checkbox":
+            # Airtable leaves unchecked boxes out of the record
+            return True if rng.random() < 0.5 else None  # noqa: PLR2004
+        if field_type == "singleSelect":
+            return rng.choice(SELECT_CHOICES)
+        if field_type == "multipleSelects":
+            return rng.sample(SELECT_CHOICES, rng.randint(1, 3))
+        if field_type == "date":
+            return f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        if field_type == "dateTime":
+            return f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00.000Z"
+        if field_type == "multipleAttachments":
+            return [
+                {
+                    "id": f"att{table:04d}{record:07d}{attachment:03d}",
+                    "url": f"https://example.com/{table}/{record}/{attachment}.png",
+                    "filename": f"{attachment}.png",
+                    "size": rng.randint(1000, 1000000),
+                    "type": "image/png",
+                    "width": 640,
+                    "height": 480,
+                }
+                for attachment in range(rng.randint(0, 2))
+            ]
+        if field_type == "multipleRecordLinks":
+            linked_table = self.table_index[field["options"]["linkedTableId"]]
+            links = int(self.spec.link_density) + (rng.random() < self.spec.link_density % 1)
+            return [record_id(linked_table, rng.randrange(self.spec.records)) for _ in range(links)]
+        return f"{field['name']} {record + 1}"
+
+    def record(self, table: int, record: int, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        rng = random.Random(f"{self.spec.seed}-{table}-{record}")  # noqa: S311
+        values = {}
+        for field in self.tables[table]["fields"]:
+            if fields and field["id"] not in fields and field["name"] not in fields:
+                continue
+            value = self.field_value(rng, table, record, field)
+            if value is not None and value != []:
+                values[field["name"]] = value
+        return {
+            "id": record_id(table, record),
+            "createdTime": f"2023-01-01T00:{record // 60 % 60:02d}:{record % 60:02d}.000Z",
+            "fields": values,
+        }
+
+    def page(
+        self, table: int, offset: Optional[str], page_size: int = PAGE_SIZE, fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        start = int(offset.split("/")[-1]) if offset else 0
+        end = min(start + page_size, self.spec.records)
+        page: Dict[str, Any] = {"records": [self.record(table, record, fields) for record in range(start, end)]}
+        if end < self.spec.records:
+            page["offset"] = f"itr{table:014d}/{end}"
+        return page
+
+
+class FakeAirtableServer:
+    """
+    Serves the bases from a local HTTP server, running in a background
+    thread. Each response is delayed by `latency` seconds, and any requests
+    to a base beyond `rate_limit` per second are refused with a 429 response,
+    as Airtable does. Airtable doesn't say how long to wait before trying
+    again, but for the benchmarks a Retry-After header of `retry_after`
+    seconds can be sent, rather than the client waiting 30 seconds.
+    """
+
+    def __init__(
+        self,
+        bases: List[FakeBase],
+        *,
+        latency: float = 0,
+        rate_limit: Optional[float] = None,
+        retry_after: Optional[float] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.bases = {base.id: base for base in bases}
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.host = host
+        self.requests = 0
+        self.rate_limited = 0
+        self._request_times: Dict[str, Deque[float]] = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self.handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-airtable", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self._server.server_port}"
+
+    def start(self) -> "FakeAirtableServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "FakeAirtableServer":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def allow_request(self, key: str) -> bool:
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit is None:
+                return True
+            now = time.monotonic()
+            request_times = self._request_times[key]
+            while request_times and request_times[0] <= now - 1:
+                request_times.popleft()
+            if len(request_times) >= self.rate_limit:
+                self.rate_limited += 1
+                return False
+            request_times.append(now)
+            return True
+
+    def respond(self, method: str, path: str, query: Dict[str, List[str]]) -> Tuple[int, Dict[str, Any]]:
+        parts = [part for part in path.split("/") if part][1:]
+        if parts == ["meta", "bases"]:
+            return 200, {
+                "bases": [{"id": base.id, "name": base.name, "permissionLevel": "read"} for base in self.bases.values()]
+            }
+        if len(parts) == 4 and parts[:2] == ["meta", "bases"] and parts[3] == "tables":  # noqa: PLR2004
+            base = self.bases.get(parts[2])
+            if base is None:
+                return 404, {"error": "NOT_FOUND"}
+            return 200, {"tables": base.tables}
+        if len(parts) in (2, 3) and parts[0] in self.bases:
+            base = self.bases[parts[0]]
+            if parts[1] not in base.table_index or (len(parts) == 3 and parts[2] != "listRecords"):  # noqa: PLR2004
+                return 404, {"error": "NOT_FOUND"}
+            if method == "POST" and len(parts) == 2:  # noqa: PLR2004
+                return 404, {"error": "NOT_FOUND"}
+            # views and formulas aren't applied, every record is returned
+            fields = query.get("fields[]", query.get("fields"))
+            page_size = int(query.get("pageSize", [PAGE_SIZE])[0])
+            offset = query.get("offset", [None])[0]
+            return 200, base.page(base.table_index[parts[1]], offset, min(page_size, PAGE_SIZE), fields)
+        return 404, {"error": "NOT_FOUND"}
+
+    def handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                url = urlsplit(self.path)
+                self.handle_request("GET", url.path, parse_qs(url.query))
+
+            def do_POST(self) -> None:
+                # pyairtable switches to POST when the URL would be too long,
+                # sending the options as JSON instead
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                query = {key: value if isinstance(value, list) else [value] for key, value in body.items()}
+                self.handle_request("POST", urlsplit(self.path).path, query)
+
+            def handle_request(self, method: str, path: str, query: Dict[str, List[str]]) -> None:
+                if server.latency:
+                    time.sleep(server.latency)
+                base_id = path.split("/")[-2] if path.endswith("/tables") else path.split("/")[2]
+                if not server.allow_request(base_id):
+                    status, body = 429, {"errors": [{"error": "RATE_LIMIT_REACHED"}]}
+                else:
+                    status, body = server.respond(method, path, query)
+                content = json.dumps(body).encode("utf8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                if status == 429 and server.retry_after is not None:  # noqa: PLR2004
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        return Handler
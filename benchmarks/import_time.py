@@ -0,0 +1,109 @@
+"""
+Measures how long the command line tool takes to start when it doesn't run
+an export (for `--help`, `--version` or an invalid option), and checks that
+it doesn't import the libraries that are only needed for an export.
+
+    python -m benchmarks.import_time --repeat 10
+"""
+
+import json
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import click
+
+CLI_MODULE = "airtable_to_sqlite.cli"
+
+# only needed once an export starts
+HEAVY_MODULES = ("pyairtable", "pydantic", "requests", "sqlite_utils", "tqdm", "diskcache", "dotenv")
+
+COMMANDS = {
+    "import": [sys.executable, "-c", f"import {CLI_MODULE}"],
+    "--version": [sys.executable, "-m", "airtable_to_sqlite", "--version"],
+    "--help": [sys.executable, "-m", "airtable_to_sqlite", "--help"],
+}
+
+
+def time_command(args: List[str], repeat: int = 5) -> float:
+    """The quickest of `repeat` runs of the command, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, capture_output=True)  # noqa: S603
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def import_times(module: str = CLI_MODULE) -> List[Tuple[str, float]]:
+    """
+    The time taken to import `module` and each package it imports directly
+    or indirectly, in seconds, using `python -X importtime`. Packages are
+    sorted with the slowest first.
+    """
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], check=True, capture_output=True, text=True
+    )
+    packages: Dict[str, float] = {}
+    started = False
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:  # noqa: PLR2004
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            # the header row
+            continue
+        # modules imported by a module are indented below it, and are
+        # included in its cumulative time
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        started = started or name.strip().startswith(module.split(".", maxsplit=1)[0])
+        if started and depth <= 1:
+            packages[name.strip()] = int(cumulative) / 1_000_000
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+def loaded_heavy_modules(module: str = CLI_MODULE) -> List[str]:
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", f"import sys, {module}; print('\\n'.join(sys.modules))"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    loaded = set(result.stdout.split())
+    return [name for name in HEAVY_MODULES if name in loaded]
+
+
+def run_import_benchmark(repeat: int = 5) -> Dict[str, Any]:
+    return {
+        "commands": {name: time_command(args, repeat) for name, args in COMMANDS.items()},
+        "imports": dict(import_times()[:10]),
+        "heavy_modules": loaded_heavy_modules(),
+    }
+
+
+def format_results(results: Dict[str, Any]) -> str:
+    lines = ["Time to run:"]
+    for name, seconds in results["commands"].items():
+        lines.append(f"  {name:<32} {seconds:8.3f}s")
+    lines.append(f"Slowest imports of {CLI_MODULE}:")
+    for name, seconds in results["imports"].items():
+        lines.append(f"  {name:<32} {seconds:8.3f}s")
+    lines.append(f"Heavy modules imported: {', '.join(results['heavy_modules']) or 'none'}")
+    return "\n".join(lines)
+
+
+@click.command()
+@click.option("--repeat", default=5, show_default=True, help="Number of times to run each command")
+@click.option("--json", "as_json", is_flag=True, default=False, help="Print the results as JSON")
+@click.option("--check", is_flag=True, default=False, help="Fail if any heavy modules are imported")
+def benchmark(repeat, as_json, check):
+    results = run_import_benchmark(repeat)
+    click.echo(json.dumps(results, indent=2) if as_json else format_results(results))
+    if check and results["heavy_modules"]:
+        msg = f"{CLI_MODULE} imports {', '.join(results['heavy_modules'])}"
+        raise click.ClickException(msg)
+
+
+if __name__ == "__main__":
+    benchmark()
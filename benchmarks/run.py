@@ -0,0 +1,166 @@
+"""
+Exports a synthetic base from a local fake Airtable server, and reports how
+long it took.
+
+    python -m benchmarks.run --tables 10 --records 5000 --latency 0.05
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional
+
+import click
+from sqlite_utils import Database
+
+from airtable_to_sqlite.api import RateLimiter, RequestMetrics, RetryPolicy, get_api
+from airtable_to_sqlite.async_main import AsyncAirtableBaseToSqlite
+from airtable_to_sqlite.constants import AirtablePersonalAccessToken
+from airtable_to_sqlite.main import AirtableBaseToSqlite, bulk_loading
+from airtable_to_sqlite.schema import BaseRecord
+from airtable_to_sqlite.stats import peak_rss
+from benchmarks.fake_airtable import FIELD_TYPES, BaseSpec, FakeAirtableServer, FakeBase
+
+
+def run_benchmark(
+    spec: BaseSpec,
+    database: str,
+    *,
+    latency: float = 0,
+    rate_limit: Optional[float] = None,
+    retry_after: Optional[float] = 1,
+    client_rate: float = 5,
+    use_async: bool = False,
+    bulk_load: bool = False,
+    **kwargs: Any,
+) -> Dict[str, Any]:
+    """
+    Exports a synthetic base to `database`, returning the time taken by
+    each phase, the records exported per second and the peak memory use.
+    Any other keyword arguments are passed to the exporter.
+    """
+    base = FakeBase(spec)
+    token = AirtablePersonalAccessToken("patBenchmark")
+    metrics = RequestMetrics()
+    with FakeAirtableServer([base], latency=latency, rate_limit=rate_limit, retry_after=retry_after) as server:
+        api = get_api(
+            token,
+            rate_limiter=RateLimiter(rate=client_rate),
+            retry_policy=RetryPolicy(base_delay=0.1),
+            metrics=metrics,
+            endpoint_url=server.url,
+        )
+        db = Database(database, recreate=True)
+        exporter_class = AsyncAirtableBaseToSqlite if use_async else AirtableBaseToSqlite
+        exporter = exporter_class(
+            token, db, BaseRecord(id=base.id, name=base.name, permissionLevel="read"), api=api, **kwargs
+        )
+        try:
+            with bulk_loading(db) if bulk_load else contextlib.nullcontext():
+                stats = exporter.run()
+        finally:
+            db.close()
+        rate_limited = server.rate_limited
+    return {
+        "records": spec.total_records,
+        "seconds": stats.seconds,
+        "records_per_second": spec.total_records / stats.seconds,
+        "peak_rss": peak_rss(),
+        "phases": stats.phases,
+        "tables": {table_name: table_stats.seconds for table_name, table_stats in stats.tables.items()},
+        "requests": metrics.as_dict(),
+        "rate_limited": rate_limited,
+    }
+
+
+def format_results(results: Dict[str, Any]) -> str:
+    lines = [
+        f"Records:          {results['records']:,}",
+        f"Total time:       {results['seconds']:.2f}s",
+        f"Records/sec:      {results['records_per_second']:,.0f}",
+    ]
+    if results["peak_rss"] is not None:
+        lines.append(f"Peak RSS:         {results['peak_rss'] / 1024 / 1024:,.1f} MiB")
+    lines.append(f"Requests:         {results['requests']['requests']:,} ({results['rate_limited']:,} rate limited)")
+    lines.append("Time per phase:")
+    for name, seconds in results["phases"].items():
+        lines.append(f"  {name:<27} {seconds:8.3f}s")
+    lines.append("Time per table:")
+    for name, seconds in results["tables"].items():
+        lines.append(f"  {name:<27} {seconds:8.3f}s")
+    return "\n".join(lines)
+
+
+@click.command()
+@click.option("--tables", default=5, show_default=True, help="Number of tables in the base")
+@click.option("--records", default=1000, show_default=True, help="Number of records in each table")
+@click.option("--fields-per-type", default=1, show_default=True, help="Number of fields of each field type")
+@click.option(
+    "--field-type",
+    "field_types",
+    multiple=True,
+    type=click.Choice(FIELD_TYPES),
+    help="Only generate fields of this type (can be given more than once)",
+)
+@click.option("--link-density", default=1.0, show_default=True, help="Average number of links per link field")
+@click.option("--seed", default=0, show_default=True, help="Seed for the generated values")
+@click.option("--latency", default=0.0, show_default=True, help="Seconds the server waits before each response")
+@click.option("--rate-limit", type=float, help="Requests per second per base allowed by the server")
+@click.option(
+    "--retry-after", default=1.0, show_default=True, help="Retry-After header sent with rate limited responses"
+)
+@click.option("--client-rate", default=5.0, show_default=True, help="Requests per second made by the client")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows to buffer before writing")
+@click.option("--concurrency", default=1, show_default=True, help="Number of tables to fetch at the same time")
+@click.option("--async", "use_async", is_flag=True, default=False, help="Use the asyncio pipeline")
+@click.option("--bulk-load", is_flag=True, default=False, help="Load the database in a single transaction")
+@click.option("--child-tables", is_flag=True, default=False, help="Store multi-value fields in child tables")
+@click.option("--output", type=click.Path(dir_okay=False), help="Keep the database at this path")
+@click.option("--json", "as_json", is_flag=True, default=False, help="Print the results as JSON")
+def benchmark(
+    tables,
+    records,
+    fields_per_type,
+    field_types,
+    link_density,
+    seed,
+    latency,
+    rate_limit,
+    retry_after,
+    client_rate,
+    batch_size,
+    concurrency,
+    use_async,
+    bulk_load,
+    child_tables,
+    output,
+    as_json,
+):
+    spec = BaseSpec(
+        tables=tables,
+        records=records,
+        fields_per_type=fields_per_type,
+        link_density=link_density,
+        field_types=field_types or FIELD_TYPES,
+        seed=seed,
+    )
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        results = run_benchmark(
+            spec,
+            output or os.path.join(tmpdirname, "benchmark.db"),
+            latency=latency,
+            rate_limit=rate_limit,
+            retry_after=retry_after,
+            client_rate=client_rate,
+            use_async=use_async,
+            bulk_load=bulk_load,
+            batch_size=batch_size,
+            concurrency=concurrency,
+            child_tables=child_tables,
+        )
+    click.echo(json.dumps(results, indent=2) if as_json else format_results(results))
+
+
+if __name__ == "__main__":
+    benchmark()
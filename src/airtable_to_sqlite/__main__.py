@@ -3,11 +3,21 @@
 # SPDX-License-Identifier: MIT
 import sys
 
-from dotenv import load_dotenv
+# these are answered without running an export, so they don't need the
+# settings from a .env file
+NO_EXPORT_OPTIONS = {"-h", "--help", "--version"}
 
-load_dotenv()
 
-if __name__ == "__main__":
-    from airtable_to_sqlite.cli import airtable_to_sqlite
+def main() -> None:
+    if not NO_EXPORT_OPTIONS.intersection(sys.argv[1:]):
+        from dotenv import load_dotenv  # noqa: PLC0415
+
+        load_dotenv()
+
+    from airtable_to_sqlite.cli import airtable_to_sqlite  # noqa: PLC0415
 
     sys.exit(airtable_to_sqlite(auto_envvar_prefix="AIRTABLE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Optional, Union
+
+import requests
+from pyairtable.api.api import Api as AirtableApi
+from requests.adapters import HTTPAdapter
+
+from airtable_to_sqlite.cache import ResponseCache
+from airtable_to_sqlite.constants import (
+    AIRTABLE_API_URL,
+    AIRTABLE_REQUESTS_PER_SECOND,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    RATE_LIMIT_BACKOFF,
+    RETRY_BASE_DELAY,
+    RETRY_JITTER,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY,
+    RETRY_STATUS_CODES,
+    AirtablePersonalAccessToken,
+)
+
+logger = logging.getLogger(__name__)
+
+BASE_ID_REGEX = re.compile(r"/(app[A-Za-z0-9]+)(?=/|\?|$)")
+
+
+def get_base_id(url: str) -> str:
+    match = BASE_ID_REGEX.search(url)
+    return match.group(1) if match else ""
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket. Each call to `acquire` takes a token, blocking
+    until one is available. Tokens are replenished at `rate` per second, up to
+    a maximum of `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, delay: float) -> None:
+        # stop handing out tokens to any thread until the delay has passed
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            self._tokens = 0
+            self._updated = self._blocked_until
+
+
+class RateLimiter:
+    """
+    Keeps a separate token bucket for each Airtable base, as the API rate
+    limit is applied per base. Requests that aren't for a particular base
+    (eg listing bases) share a bucket.
+    """
+
+    def __init__(self, rate: float = AIRTABLE_REQUESTS_PER_SECOND) -> None:
+        self.rate = rate
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket_for(self, url: str) -> TokenBucket:
+        key = get_base_id(url)
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.rate)
+            return self._buckets[key]
+
+
+def get_retry_after(response: requests.Response, default: float) -> float:
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return default
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        return default
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed request should be tried again, and how long to
+    wait first.
+
+    Rate limit errors wait for the time given in the Retry-After header, or
+    `rate_limit_backoff` seconds if there isn't one. Server and connection
+    errors wait an exponentially increasing delay, starting at `base_delay`
+    seconds and capped at `max_delay`. A random extra delay of up to
+    `jitter` times the delay is added, so that requests that failed together
+    aren't all retried at the same moment.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        jitter: float = RETRY_JITTER,
+        rate_limit_backoff: float = RATE_LIMIT_BACKOFF,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.rate_limit_backoff = rate_limit_backoff
+
+    def should_retry(self, attempt: int, response: Optional[requests.Response] = None) -> bool:
+        if attempt >= self.max_attempts:
+            return False
+        return response is None or response.status_code in RETRY_STATUS_CODES
+
+    def delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        if response is not None and response.status_code == requests.codes.too_many_requests:
+            delay = get_retry_after(response, self.rate_limit_backoff)
+        elif response is not None and "Retry-After" in response.headers:
+            delay = get_retry_after(response, self.base_delay)
+        else:
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay + random.uniform(0, delay * self.jitter)  # noqa: S311
+
+
+class RequestMetrics:
+    """
+    Thread-safe counts of the requests made to Airtable, the bytes received
+    and the requests that were retried, by the reason they were retried.
+    Counts are kept for each base, as well as in total.
+    """
+
+    def __init__(self) -> None:
+        self.requests: Counter[str] = Counter()
+        self.bytes: Counter[str] = Counter()
+        self.retries: Dict[str, Counter[str]] = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record_request(self, base_id: str = "") -> None:
+        with self._lock:
+            self.requests[base_id] += 1
+
+    def record_response(self, response: requests.Response, base_id: str = "") -> None:
+        # the size sent over the network, before it is decompressed
+        content_length = response.headers.get("Content-Length")
+        size = int(content_length) if content_length and content_length.isdigit() else len(response.content)
+        with self._lock:
+            self.bytes[base_id] += size
+
+    def record_retry(self, reason: str, base_id: str = "") -> None:
+        with self._lock:
+            self.retries[base_id][reason] += 1
+
+    def as_dict(self, base_id: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            if base_id is not None:
+                return {
+                    "requests": self.requests[base_id],
+                    "bytes": self.bytes[base_id],
+                    "retries": dict(self.retries[base_id]),
+                }
+            retries: Counter[str] = Counter()
+            for base_retries in self.retries.values():
+                retries.update(base_retries)
+            return {
+                "requests": sum(self.requests.values()),
+                "bytes": sum(self.bytes.values()),
+                "retries": dict(retries),
+            }
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    Transport adapter that waits for a token from the rate limiter before
+    each request, and retries failed requests according to the retry policy.
+    When Airtable responds with 429 Too Many Requests, every request to the
+    same base is paused.
+
+    If a cache is given then responses are looked up there first, and
+    successful responses are added to it.
+    """
+
+    def __init__(
+        self,
+        rate_limiter: RateLimiter,
+        retry_policy: Optional[RetryPolicy] = None,
+        cache: Optional[ResponseCache] = None,
+        metrics: Optional[RequestMetrics] = None,
+        **kwargs: Any,
+    ) -> None:
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.cache = cache
+        self.metrics = metrics or RequestMetrics()
+        super().__init__(**kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:  # type: ignore[override]
+        if self.cache is not None:
+            cached_response = self.cache.lookup(request)
+            if cached_response is not None:
+                return cached_response
+
+        # this tool only ever reads from Airtable, so every request is safe
+        # to send again
+        base_id = get_base_id(request.url or "")
+        bucket = self.rate_limiter.bucket_for(request.url or "")
+        attempt = 1
+        while True:
+            bucket.acquire()
+            self.metrics.record_request(base_id)
+            response: Optional[requests.Response] = None
+            error: Union[requests.ConnectionError, requests.Timeout, None] = None
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not self.retry_policy.should_retry(attempt):
+                    raise
+                error = e
+            if response is not None and not self.retry_policy.should_retry(attempt, response):
+                self.metrics.record_response(response, base_id)
+                if self.cache is not None:
+                    self.cache.store(request, response)
+                return response
+
+            delay = self.retry_policy.delay(attempt, response)
+            reason = type(error).__name__ if response is None else str(response.status_code)
+            self.metrics.record_retry(reason, base_id)
+            logger.warning(
+                f"Request to {request.url} failed ({reason}), retrying in {delay:.1f} seconds (attempt {attempt})"
+            )
+            if response is not None:
+                response.close()
+            if response is not None and response.status_code == requests.codes.too_many_requests:
+                # the rate limit applies to the whole base, so every request
+                # to it waits
+                bucket.backoff(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+
+
+def get_api(
+    personal_access_token: AirtablePersonalAccessToken,
+    rate_limiter: Optional[RateLimiter] = None,
+    cache: Optional[ResponseCache] = None,
+    *,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout: Optional[int] = DEFAULT_TIMEOUT,
+    retry_policy: Optional[RetryPolicy] = None,
+    metrics: Optional[RequestMetrics] = None,
+    endpoint_url: str = AIRTABLE_API_URL,
+) -> AirtableApi:
+    """
+    Creates a client for the Airtable API. Its session keeps a pool of
+    connections open, so it should be shared by every base and table that is
+    exported, to avoid opening a new connection for each of them.
+
+    `endpoint_url` points the client at a different server than the
+    Airtable API, such as the fake server used by the benchmarks.
+    """
+    # rate limiting and retrying on 429 responses is handled by our adapter
+    # instead of pyairtable's default retry strategy
+    api = AirtableApi(
+        personal_access_token,
+        timeout=None if timeout is None else (timeout, timeout),
+        retry_strategy=None,
+        endpoint_url=endpoint_url,
+    )
+    adapter = RateLimitedAdapter(
+        rate_limiter or RateLimiter(),
+        retry_policy=retry_policy,
+        cache=cache,
+        metrics=metrics,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+    )
+    api.session.mount("https://", adapter)
+    api.session.mount("http://", adapter)
+    return api
+
+
+def get_request_metrics(api: AirtableApi) -> Optional[RequestMetrics]:
+    adapter = api.session.get_adapter(api.build_url())
+    if isinstance(adapter, RateLimitedAdapter):
+        return adapter.metrics
+    return None
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Union
+
+from tqdm import tqdm
+
+from airtable_to_sqlite.constants import DEFAULT_QUEUE_SIZE
+from airtable_to_sqlite.main import AirtableBaseToSqlite, PageRows, TableFinished, TablePage
+from airtable_to_sqlite.schema import TableSchema
+
+logger = logging.getLogger(__name__)
+
+PipelineItem = Union[PageRows, TableFinished, BaseException]
+
+
+class AsyncAirtableBaseToSqlite(AirtableBaseToSqlite):
+    """
+    Creates the same database as AirtableBaseToSqlite, but fetches and
+    transforms records in an asyncio pipeline running in a background thread,
+    while the calling thread writes the rows to the database. Fetching,
+    transforming and writing pages all happen at the same time.
+
+    Tables are fetched by up to `concurrency` tasks, which pass pages through
+    bounded queues, so no more than `queue_size` pages are held in memory at
+    each stage. Requests are still made through the same API client, so they
+    are rate limited, retried and cached in the same way.
+    """
+
+    def __init__(self, *args: Any, queue_size: int = DEFAULT_QUEUE_SIZE, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.queue_size = queue_size
+
+    def insert_all_table_data(self) -> None:
+        logger.info("Fetching table data")
+        tables = self.tables_to_fetch()
+        # anything that reads from the database is done before the pipeline
+        # starts, as the connection can only be used from this thread
+        for table in tables:
+            self.get_table_plan(table)
+        fetch_options = {table.id: self.get_fetch_options(table) for table in tables}
+        offsets = {table.id: self.checkpoints.get(table.id, {}).get("offset") for table in tables}
+        rows: queue.Queue[PipelineItem] = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        sync_started = datetime.now(timezone.utc)
+        pipeline = threading.Thread(
+            target=asyncio.run,
+            args=(self.run_pipeline(tables, fetch_options, offsets, rows, stop),),
+            name="airtable-to-sqlite-pipeline",
+            daemon=True,
+        )
+        pipeline.start()
+
+        tables_remaining = len(tables)
+        progress = tqdm(desc=self._base.name, unit=" records")
+        try:
+            while tables_remaining:
+                try:
+                    item = rows.get(timeout=1)
+                except queue.Empty:
+                    if not pipeline.is_alive():
+                        msg = "The pipeline fetching records from Airtable stopped unexpectedly"
+                        raise RuntimeError(msg) from None
+                    continue
+                if isinstance(item, BaseException):
+                    raise item
+                if isinstance(item, TableFinished):
+                    tables_remaining -= 1
+                    if item.complete:
+                        self.finish_table(item.table, sync_started, item.record_ids)
+                    continue
+                self.add_page_rows(item)
+                progress.update(len(item.records))
+            self.flush()
+        except BaseException:
+            # keep draining the queue so that the pipeline is never left
+            # blocked waiting for space
+            stop.set()
+            while pipeline.is_alive():
+                try:
+                    rows.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            raise
+        finally:
+            progress.close()
+        pipeline.join()
+
+    async def run_pipeline(
+        self,
+        tables: List[TableSchema],
+        fetch_options: Dict[str, Dict[str, Any]],
+        offsets: Dict[str, Optional[str]],
+        rows: "queue.Queue[PipelineItem]",
+        stop: threading.Event,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        pages: asyncio.Queue[Optional[Union[TablePage, TableFinished]]] = asyncio.Queue(maxsize=self.queue_size)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_table(table: TableSchema) -> None:
+            async with semaphore:
+                # requests are blocking, so each page is fetched in the
+                # event loop's thread pool
+                table_pages = self.fetch_table_pages(table, offsets[table.id], **fetch_options[table.id])
+                while not stop.is_set():
+                    page = await loop.run_in_executor(None, next, table_pages, None)
+                    if page is None:
+                        break
+                    records, next_offset = page
+                    await pages.put(TablePage(table, records, next_offset))
+                record_ids = None
+                if self.incremental and not stop.is_set():
+                    record_ids = await loop.run_in_executor(None, self.get_record_ids, table)
+                await pages.put(TableFinished(table, complete=not stop.is_set(), record_ids=record_ids))
+
+        async def transform() -> None:
+            while True:
+                item = await pages.get()
+                if item is None:
+                    return
+                rows_item: PipelineItem
+                if isinstance(item, TablePage):
+                    rows_item = self.transform_page(item.table, item.records, item.offset)
+                else:
+                    rows_item = item
+                # the rows queue is shared with the writing thread, so waiting
+                # for space in it mustn't block the event loop
+                await loop.run_in_executor(None, rows.put, rows_item)
+
+        async def fetch_all_tables() -> None:
+            await asyncio.gather(*(fetch_table(table) for table in tables))
+            await pages.put(None)
+
+        try:
+            await asyncio.gather(fetch_all_tables(), transform())
+        except Exception as error:
+            # any tasks still running are cancelled when the event loop closes
+            await loop.run_in_executor(None, rows.put, error)
@@ -0,0 +1,246 @@
+import hashlib
+import logging
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, NamedTuple, Optional, Set, Tuple
+
+import requests
+import sqlite_utils
+from requests.adapters import HTTPAdapter
+from sqlite_utils import Database
+from urllib3.util.retry import Retry
+
+from airtable_to_sqlite.constants import (
+    ATTACHMENT_CHUNK_SIZE,
+    ATTACHMENT_CONTENT_TABLE,
+    ATTACHMENT_QUEUE_FACTOR,
+    ATTACHMENT_TABLE,
+    DEFAULT_ATTACHMENT_WORKERS,
+    DEFAULT_TIMEOUT,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_STATUS_CODES,
+    TEMPORARY_FILE_SUFFIX,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadedFile(NamedTuple):
+    hash: str
+    size: int
+    # the content of the file when it is stored in the database, or its path
+    # within the directory
+    content: Optional[bytes]
+    path: Optional[str]
+
+
+class AttachmentDownloader:
+    """
+    Downloads the files in attachment fields, using a pool of threads so
+    that downloads happen while records are still being fetched.
+
+    Files are stored by the SHA-256 hash of their content, so a file that is
+    attached more than once is only stored once. They are kept in the
+    `_attachment_content` table, or in `directory` if one is given. The
+    `_attachment` table links each attachment ID to the hash of its file, and
+    attachments that are already in it (or, for a directory, that have been
+    downloaded to the directory before) aren't downloaded again.
+
+    `submit` and `write_finished` must be called from the thread that writes
+    to the database.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        directory: Optional[str] = None,
+        *,
+        workers: int = DEFAULT_ATTACHMENT_WORKERS,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        timeout: int = DEFAULT_TIMEOUT,
+    ) -> None:
+        self._db = db
+        self.directory = directory
+        self.timeout = timeout
+        self.max_pending = workers * ATTACHMENT_QUEUE_FACTOR
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=workers,
+            pool_maxsize=workers,
+            max_retries=Retry(
+                total=max_attempts - 1,
+                backoff_factor=RETRY_BASE_DELAY,
+                status_forcelist=RETRY_STATUS_CODES,
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="airtable-to-sqlite-attachments")
+        self._pending: Dict[str, Tuple[Future[DownloadedFile], Dict[str, Any]]] = {}
+        self._stored_ids: Set[str] = set()
+        self.counts: Counter[str] = Counter()
+        self.attachment_table: Optional[sqlite_utils.db.Table] = None
+        self.content_table: Optional[sqlite_utils.db.Table] = None
+
+    def create_tables(self) -> None:
+        db_table = self._db.table(ATTACHMENT_TABLE)
+        if isinstance(db_table, sqlite_utils.db.Table):
+            db_table.create(
+                columns={
+                    "id": str,
+                    "recordId": str,
+                    "fieldId": str,
+                    "filename": str,
+                    "type": str,
+                    "size": int,
+                    "hash": str,
+                    "path": str,
+                },
+                pk="id",
+                ignore=True,
+            )
+            self.attachment_table = db_table
+            self._stored_ids = {row["id"] for row in db_table.rows_where(select="id")}
+        else:  # pragma: no cover
+            pass
+        if self.directory is not None:
+            os.makedirs(os.path.join(self.directory, "ids"), exist_ok=True)
+            return
+        db_table = self._db.table(ATTACHMENT_CONTENT_TABLE)
+        if isinstance(db_table, sqlite_utils.db.Table):
+            db_table.create(columns={"hash": str, "content": bytes}, pk="hash", ignore=True)
+            self.content_table = db_table
+        else:  # pragma: no cover
+            pass
+
+    def submit(self, record_id: str, field_id: str, attachment: Dict[str, Any]) -> None:
+        attachment_id = attachment.get("id")
+        url = attachment.get("url")
+        if not attachment_id or not url or attachment_id in self._pending:
+            return
+        if attachment_id in self._stored_ids:
+            self.counts["skipped"] += 1
+            return
+        row = {
+            "id": attachment_id,
+            "recordId": record_id,
+            "fieldId": field_id,
+            "filename": attachment.get("filename"),
+            "type": attachment.get("type"),
+        }
+        previous = self.find_downloaded(attachment_id)
+        if previous is not None:
+            self.counts["skipped"] += 1
+            self.write_row(row, previous)
+            return
+        # wait for a download to finish if too many are waiting to be written,
+        # so that the number of files held in memory is limited
+        while len(self._pending) >= self.max_pending:
+            wait([future for future, _ in self._pending.values()], return_when=FIRST_COMPLETED)
+            self.write_finished()
+        self._pending[attachment_id] = (self._executor.submit(self.download, attachment_id, url), row)
+
+    def write_finished(self, *, wait_for_all: bool = False) -> None:
+        for attachment_id, (future, row) in list(self._pending.items()):
+            if not wait_for_all and not future.done():
+                continue
+            del self._pending[attachment_id]
+            try:
+                downloaded = future.result()
+            except Exception as error:
+                # the URLs that Airtable gives for attachments expire, so a
+                # failed download shouldn't stop the export
+                logger.warning(f"Could not download attachment {attachment_id} ({row['filename']}): {error}")
+                self.counts["failed"] += 1
+                continue
+            self.counts["downloaded"] += 1
+            self.counts["bytes"] += downloaded.size
+            self.write_row(row, downloaded)
+
+    def write_row(self, row: Dict[str, Any], downloaded: DownloadedFile) -> None:
+        if self.content_table is not None and downloaded.content is not None:
+            self.content_table.insert({"hash": downloaded.hash, "content": downloaded.content}, ignore=True)
+        if self.attachment_table is not None:
+            self.attachment_table.insert(
+                {**row, "size": downloaded.size, "hash": downloaded.hash, "path": downloaded.path}, replace=True
+            )
+        self._stored_ids.add(row["id"])
+
+    def content_path(self, content_hash: str) -> str:
+        return os.path.join(content_hash[:2], content_hash)
+
+    def id_path(self, attachment_id: str) -> str:
+        if self.directory is None:  # pragma: no cover
+            msg = "Attachments are only indexed by ID when they are stored in a directory"
+            raise ValueError(msg)
+        return os.path.join(self.directory, "ids", attachment_id)
+
+    def find_downloaded(self, attachment_id: str) -> Optional[DownloadedFile]:
+        # the directory can be shared between exports, so it keeps its own
+        # record of the hash of each attachment that has been downloaded
+        if self.directory is None or not os.path.exists(self.id_path(attachment_id)):
+            return None
+        with open(self.id_path(attachment_id), encoding="utf8") as f:
+            content_hash = f.read().strip()
+        path = self.content_path(content_hash)
+        if not os.path.exists(os.path.join(self.directory, path)):
+            return None
+        return DownloadedFile(content_hash, os.path.getsize(os.path.join(self.directory, path)), None, path)
+
+    def download(self, attachment_id: str, url: str) -> DownloadedFile:
+        digest = hashlib.sha256()
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if self.directory is None:
+                content = bytearray()
+                for chunk in response.iter_content(ATTACHMENT_CHUNK_SIZE):
+                    digest.update(chunk)
+                    content.extend(chunk)
+                return DownloadedFile(digest.hexdigest(), len(content), bytes(content), None)
+
+            # files are written under a temporary name, so that a download
+            # that is interrupted never leaves a partial file in place
+            fd, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=TEMPORARY_FILE_SUFFIX)
+            try:
+                size = 0
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in response.iter_content(ATTACHMENT_CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                path = self.content_path(digest.hexdigest())
+                os.makedirs(os.path.join(self.directory, os.path.dirname(path)), exist_ok=True)
+                # a file with the same hash has the same content, so it can
+                # safely be replaced
+                os.replace(temporary_path, os.path.join(self.directory, path))
+            finally:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+        self.write_id(attachment_id, digest.hexdigest())
+        return DownloadedFile(digest.hexdigest(), size, None, path)
+
+    def write_id(self, attachment_id: str, content_hash: str) -> None:
+        fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(self.id_path(attachment_id)))
+        with os.fdopen(fd, "w", encoding="utf8") as f:
+            f.write(content_hash)
+        os.replace(temporary_path, self.id_path(attachment_id))
+
+    def finish(self) -> None:
+        self.write_finished(wait_for_all=True)
+        logger.info(
+            "Downloaded {downloaded} attachments ({bytes} bytes), skipped {skipped}, failed {failed}".format(
+                **{key: self.counts[key] for key in ("downloaded", "bytes", "skipped", "failed")}
+            )
+        )
+
+    def close(self) -> None:
+        # downloads that haven't started are cancelled, and any that have
+        # are left to finish
+        for future, _ in self._pending.values():
+            future.cancel()
+        self._pending = {}
+        self._executor.shutdown(wait=True)
+        self.session.close()
@@ -0,0 +1,90 @@
+import hashlib
+import logging
+from typing import Optional
+
+import diskcache
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from airtable_to_sqlite.constants import DEFAULT_CACHE_SIZE_LIMIT, DEFAULT_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Stores successful responses from the Airtable API on disk, so that
+    running an export again doesn't request the same data a second time.
+
+    Entries expire after `ttl` seconds, and the least recently used entries
+    are removed once the cache grows beyond `size_limit` bytes.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = DEFAULT_CACHE_TTL,
+        size_limit: int = DEFAULT_CACHE_SIZE_LIMIT,
+    ) -> None:
+        self.ttl = ttl
+        self._cache = diskcache.Cache(
+            directory,
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+        )
+
+    @staticmethod
+    def is_cacheable(request: requests.PreparedRequest) -> bool:
+        # Long record list requests are sent as a POST to /listRecords, but
+        # are still only reading data
+        if request.method == "GET":
+            return True
+        return request.method == "POST" and (request.url or "").endswith("/listRecords")
+
+    @staticmethod
+    def key(request: requests.PreparedRequest) -> str:
+        # the access token is part of the key so that responses are never
+        # shared between users, but only a hash of it is stored
+        key = hashlib.sha256()
+        for part in (
+            request.method,
+            request.url,
+            request.headers.get("Authorization"),
+            request.body,
+        ):
+            data = part.encode("utf8") if isinstance(part, str) else part
+            key.update(data if isinstance(data, bytes) else b"")
+            key.update(b"\0")
+        return key.hexdigest()
+
+    def lookup(self, request: requests.PreparedRequest) -> Optional[requests.Response]:
+        if not self.is_cacheable(request):
+            return None
+        cached = self._cache.get(self.key(request))
+        if cached is None:
+            return None
+        logger.debug(f"Using cached response for {request.url}")
+        status_code, headers, content = cached
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content
+        response.url = request.url or ""
+        response.request = request
+        response.reason = "OK"
+        return response
+
+    def store(self, request: requests.PreparedRequest, response: requests.Response) -> None:
+        if not self.is_cacheable(request) or response.status_code != requests.codes.ok:
+            return
+        self._cache.set(
+            self.key(request),
+            (response.status_code, dict(response.headers), response.content),
+            expire=self.ttl,
+        )
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def close(self) -> None:
+        self._cache.close()
@@ -2,19 +2,30 @@
 #
 # SPDX-License-Identifier: MIT
 
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import click
-from sqlite_utils import Database
 
 from airtable_to_sqlite.__about__ import __version__
 from airtable_to_sqlite.constants import (
+    DEFAULT_ATTACHMENT_WORKERS,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CACHE_SIZE_LIMIT,
+    DEFAULT_CACHE_TTL,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_ATTEMPTS,
     AirtablePersonalAccessToken,
     PreferedNamingMethod,
 )
-from airtable_to_sqlite.main import AirtableBaseToSqlite, get_base_records
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(name)s:%(message)s")
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = "{}.db"
 
 
 @click.group(context_settings={"help_option_names": ["-h", "--help"]}, invoke_without_command=True)
@@ -24,22 +35,342 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(name
 @click.option(
     "--output",
     type=click.Path(exists=False),
-    default="{}.db",
-    help="Output filename (default: '{}.db'). Use '{}' to insert base name",
+    default=DEFAULT_OUTPUT,
+    help="Output filename (default: '{}.db'), or directory for --format ndjson or csv. Use '{}' to insert base name",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["sqlite", "ndjson", "csv"]),
+    default="sqlite",
+    show_default=True,
+    help="Write an SQLite database, or a directory with a newline-delimited JSON or CSV file for each table",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BATCH_SIZE,
+    show_default=True,
+    help="Number of rows to write to the database at a time",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of tables to fetch from Airtable at the same time",
+)
+@click.option(
+    "--async",
+    "use_async",
+    is_flag=True,
+    default=False,
+    help="Fetch, transform and write records at the same time, using an asyncio pipeline",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of bases to export at the same time",
+)
+@click.option(
+    "--pool-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_POOL_SIZE,
+    show_default=True,
+    help="Number of connections to Airtable to keep open, shared by all bases and tables",
+)
+@click.option(
+    "--timeout",
+    type=click.IntRange(min=1),
+    default=DEFAULT_TIMEOUT,
+    show_default=True,
+    help="Number of seconds to wait for a response from Airtable",
+)
+@click.option(
+    "--max-attempts",
+    type=click.IntRange(min=1),
+    default=RETRY_MAX_ATTEMPTS,
+    show_default=True,
+    help="Number of times to try a request to Airtable that fails with a rate limit, server or connection error",
+)
+@click.option(
+    "--retry-delay",
+    type=click.FloatRange(min=0),
+    default=RETRY_BASE_DELAY,
+    show_default=True,
+    help="Seconds to wait before retrying a failed request. Doubles after each attempt",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Update an existing database with records changed since it was last synced, instead of recreating it",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Carry on from where a previous export of the same base failed, instead of starting again",
+)
+@click.option(
+    "--bulk-load",
+    is_flag=True,
+    default=False,
+    help="Write each base in a single transaction with faster but less safe SQLite settings",
+)
+@click.option(
+    "--atomic-write",
+    is_flag=True,
+    default=False,
+    help="Build the database in a temporary file, and only replace the output file once the export has finished",
+)
+@click.option(
+    "--optimize",
+    is_flag=True,
+    default=False,
+    help="Run ANALYZE and VACUUM on the database once the export has finished",
+)
+@click.option(
+    "--stats-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Save timings, row counts and request counts for each base to this JSON file",
+)
+@click.option(
+    "--table",
+    "only_tables",
+    multiple=True,
+    metavar="TABLE",
+    help="Only export this table. Can be used more than once",
+)
+@click.option(
+    "--field",
+    "only_fields",
+    type=(str, str),
+    multiple=True,
+    metavar="TABLE FIELD",
+    help="Only export this field from the table. Can be used more than once",
+)
+@click.option(
+    "--view",
+    "views",
+    type=(str, str),
+    multiple=True,
+    metavar="TABLE VIEW",
+    help="Only export the records in this view of the table",
+)
+@click.option(
+    "--formula",
+    "formulas",
+    type=(str, str),
+    multiple=True,
+    metavar="TABLE FORMULA",
+    help="Only export the records in the table that match this formula",
+)
+@click.option(
+    "--child-tables",
+    is_flag=True,
+    default=False,
+    help="Store multiple selects, attachments and collaborators in their own tables, with a row for each value",
+)
+@click.option(
+    "--download-attachments",
+    is_flag=True,
+    default=False,
+    help="Download the files in attachment fields, storing them in the database unless --attachments-dir is given",
+)
+@click.option(
+    "--attachments-dir",
+    type=click.Path(file_okay=False),
+    help="Store downloaded attachments in this directory, which can be shared between bases and exports",
+)
+@click.option(
+    "--attachment-workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_ATTACHMENT_WORKERS,
+    show_default=True,
+    help="Number of attachments to download at the same time, for each base",
+)
+@click.option(
+    "--index",
+    "index_fields",
+    type=(str, str),
+    multiple=True,
+    metavar="TABLE FIELD",
+    help="Add an index on this field, once the records have been loaded. Can be used more than once",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Cache responses from the Airtable API in this directory, so they aren't fetched again",
+)
+@click.option(
+    "--cache-ttl",
+    type=click.IntRange(min=0),
+    default=DEFAULT_CACHE_TTL,
+    show_default=True,
+    help="Number of seconds to keep cached responses for",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CACHE_SIZE_LIMIT // (1024 * 1024),
+    show_default=True,
+    help="Maximum size of the cache in megabytes. The least recently used responses are removed first",
 )
 @click.argument("base-ids", type=str, nargs=-1)
-def airtable_to_sqlite(personal_access_token: AirtablePersonalAccessToken, prefer_ids, output, base_ids):
+def airtable_to_sqlite(
+    personal_access_token: AirtablePersonalAccessToken,
+    prefer_ids,
+    output,
+    output_format,
+    batch_size,
+    concurrency,
+    use_async,
+    jobs,
+    pool_size,
+    timeout,
+    max_attempts,
+    retry_delay,
+    incremental,
+    resume,
+    bulk_load,
+    atomic_write,
+    optimize,
+    stats_file,
+    only_tables,
+    only_fields,
+    views,
+    formulas,
+    child_tables,
+    download_attachments,
+    attachments_dir,
+    attachment_workers,
+    index_fields,
+    cache_dir,
+    cache_ttl,
+    cache_size,
+    base_ids,
+):
     prefer_ids = PreferedNamingMethod.ID if prefer_ids else PreferedNamingMethod.NAME
 
-    base_records = list(get_base_records(personal_access_token, base_ids))
+    if output_format != "sqlite":
+        sqlite_options = {
+            "--incremental": incremental,
+            "--resume": resume,
+            "--bulk-load": bulk_load,
+            "--atomic-write": atomic_write,
+            "--optimize": optimize,
+        }
+        for option, value in sqlite_options.items():
+            if value:
+                msg = f"{option} can only be used with --format sqlite"
+                raise click.BadParameter(msg, param_hint="format")
+        if download_attachments and attachments_dir is None:
+            msg = "--attachments-dir is needed to download attachments with --format " + output_format
+            raise click.BadParameter(msg, param_hint="format")
+        if output == DEFAULT_OUTPUT:
+            # the output is a directory holding a file for each table
+            output = "{}"
+
+    # these pull in pyairtable, requests and sqlite-utils, so they are only
+    # imported once an export starts, rather than for --help, --version or
+    # an invalid option
+    from airtable_to_sqlite.api import RequestMetrics, RetryPolicy, get_api  # noqa: PLC0415
+    from airtable_to_sqlite.cache import ResponseCache  # noqa: PLC0415
+    from airtable_to_sqlite.main import export_base, get_base_records  # noqa: PLC0415
+
+    cache = None
+    if cache_dir is not None:
+        cache = ResponseCache(cache_dir, ttl=cache_ttl, size_limit=cache_size * 1024 * 1024)
+
+    # a single API client is used for everything, so that connections to
+    # Airtable are reused across bases and tables
+    metrics = RequestMetrics()
+    api = get_api(
+        personal_access_token,
+        cache=cache,
+        pool_size=pool_size,
+        timeout=timeout,
+        retry_policy=RetryPolicy(max_attempts=max_attempts, base_delay=retry_delay),
+        metrics=metrics,
+    )
+    base_records = list(get_base_records(personal_access_token, base_ids, api=api))
 
     if (len(base_ids) > 1) and ("{}" not in output):
         msg = "Output filename must contain '{}' when converting a single base"
         raise click.BadParameter(msg, param_hint="output")
 
+    databases = {}
     for base in base_records:
         base_name = base.id if prefer_ids == PreferedNamingMethod.ID else base.name
-        database = output.format(base_name)
-        db = Database(database, recreate=True)
-        AirtableBaseToSqlite(personal_access_token, db, base, prefer_ids).run()
-        db.close()
+        databases[base.id] = output.format(base_name)
+    if len(set(databases.values())) < len(databases):
+        msg = "More than one base would be saved to the same file. Use --prefer-ids or change the output filename"
+        raise click.BadParameter(msg, param_hint="output")
+
+    failed = []
+    stats = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                export_base,
+                personal_access_token,
+                base,
+                databases[base.id],
+                prefer_ids,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                use_async=use_async,
+                output_format=output_format,
+                incremental=incremental,
+                resume=resume,
+                bulk_load=bulk_load,
+                atomic_write=atomic_write,
+                optimize=optimize,
+                only_tables=only_tables,
+                only_fields=only_fields,
+                views=views,
+                formulas=formulas,
+                child_tables=child_tables,
+                download_attachments=download_attachments or attachments_dir is not None,
+                attachments_dir=attachments_dir,
+                attachment_workers=attachment_workers,
+                index_fields=index_fields,
+                api=api,
+            ): base
+            for base in base_records
+        }
+        for future in as_completed(futures):
+            base = futures[future]
+            try:
+                stats.append(future.result())
+            except Exception:
+                logger.exception(f"Failed to export base {base.name} ({base.id})")
+                failed.append(base)
+
+    if cache is not None:
+        cache.close()
+
+    request_metrics = metrics.as_dict()
+    logger.info(f"Made {request_metrics['requests']} requests to Airtable, retried: {request_metrics['retries']}")
+
+    if stats_file is not None:
+        with open(stats_file, "w", encoding="utf8") as f:
+            json.dump(
+                {
+                    "bases": [base_stats.as_dict() for base_stats in stats],
+                    "failed": [base.id for base in failed],
+                    "requests": request_metrics,
+                },
+                f,
+                indent=2,
+            )
+
+    if failed:
+        msg = "Failed to export {} of {} bases: {}".format(
+            len(failed), len(base_records), ", ".join(base.id for base in failed)
+        )
+        raise click.ClickException(msg)
@@ -15,6 +15,65 @@ OPTION_FIELDS = {
     "precision": str,
     "symbol": str,
 }
+# Number of rows buffered before they are written to the database in one go
+DEFAULT_BATCH_SIZE = 1000
+
+AIRTABLE_API_URL = "https://api.airtable.com"
+
+# Airtable allows 5 requests per second per base, and asks clients to wait
+# 30 seconds before retrying once that limit has been exceeded
+AIRTABLE_REQUESTS_PER_SECOND = 5
+RATE_LIMIT_BACKOFF = 30
+
+# Failed requests are tried up to 5 times. Server and connection errors wait
+# 1, 2, 4... seconds (up to a minute) between attempts, plus up to 50% more
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 60
+RETRY_JITTER = 0.5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Number of pages waiting to be transformed or written by the async exporter
+DEFAULT_QUEUE_SIZE = 10
+
+# Connections kept open to Airtable, shared by every base and table, and the
+# number of seconds to wait for Airtable to respond
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 60
+
+# Attachments are downloaded by a pool of threads, with up to 4 downloads
+# waiting to be written for each thread. Downloaded files are stored by the
+# SHA-256 hash of their content, either in a table or in a directory.
+DEFAULT_ATTACHMENT_WORKERS = 4
+ATTACHMENT_QUEUE_FACTOR = 4
+ATTACHMENT_TABLE = "_attachment"
+ATTACHMENT_CONTENT_TABLE = "_attachment_content"
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+
+# Cached API responses are kept for an hour, in up to 1GB of disk space
+DEFAULT_CACHE_TTL = 60 * 60
+DEFAULT_CACHE_SIZE_LIMIT = 1024 * 1024 * 1024
+
+# Holds the progress of an export, so that it can be resumed if it fails.
+# Airtable responds with a 422 error once a pagination offset has expired.
+CHECKPOINT_TABLE = "_meta_checkpoint"
+INVALID_OFFSET_STATUS = 422
+
+# Older versions of SQLite only allow 999 parameters in a single statement
+SQLITE_MAX_PARAMETERS = 999
+
+# Part of the fingerprint of each table's schema. Changing how the tables
+# for an Airtable table are laid out means increasing this, so that
+# existing databases are migrated by the next incremental run.
+SCHEMA_VERSION = "2"
+
+# Added to the output filename to give the file an export is built in
+TEMPORARY_FILE_SUFFIX = ".tmp"
+
+# SQLite page cache (in KiB) and memory-mapped I/O size used for bulk loads
+BULK_LOAD_CACHE_SIZE = 256 * 1024
+BULK_LOAD_MMAP_SIZE = 256 * 1024 * 1024
+
 NUMBER_FIELD_TYPES = [
     "number",
     "percent",
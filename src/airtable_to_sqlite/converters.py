@@ -0,0 +1,185 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from airtable_to_sqlite.constants import NUMBER_FIELD_TYPES
+
+Converter = Callable[[Any], Any]
+
+
+class FieldType(NamedTuple):
+    # the type of the column, in the form used by sqlite-utils
+    column_type: Any
+    # turns a value from the Airtable API into the value that is stored
+    convert: Converter
+
+
+def to_scalar(value: Any) -> Any:
+    # fields that normally hold a single value can still return an object,
+    # for example when a formula has an error
+    if isinstance(value, (dict, list, tuple)):
+        return to_json(value)
+    return value
+
+
+def to_json(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    return json.dumps(value, ensure_ascii=False)
+
+
+# attachments are given temporary URLs that change on every request, so
+# they are left out when comparing records
+VOLATILE_KEYS = frozenset(("url", "thumbnails"))
+
+
+def normalise(value: Any) -> Any:
+    if isinstance(value, list):
+        return [
+            {key: item_value for key, item_value in item.items() if key not in VOLATILE_KEYS}
+            if isinstance(item, dict)
+            else item
+            for item in value
+        ]
+    return value
+
+
+def record_hash(record: Dict[str, Any], salt: str = "") -> str:
+    """
+    A hash of the values of a record from the Airtable API, used to tell
+    whether it has changed since it was last written. `salt` is mixed in so
+    that changing how a table is stored changes the hash of every record.
+    """
+    fields = {key: normalise(value) for key, value in record["fields"].items()}
+    content = json.dumps([salt, record.get("createdTime"), fields], sort_keys=True, ensure_ascii=False, default=str)
+    # blake2b is quicker than sha256 for the many short values hashed here
+    return hashlib.blake2b(content.encode("utf8"), digest_size=16).hexdigest()
+
+
+FIELD_TYPES: Dict[str, FieldType] = {
+    **{field_type: FieldType(float, to_scalar) for field_type in NUMBER_FIELD_TYPES},
+    "autoNumber": FieldType(int, to_scalar),
+    "rating": FieldType(int, to_scalar),
+    "duration": FieldType(float, to_scalar),
+    "checkbox": FieldType(bool, to_scalar),
+    # Airtable sends dates as ISO 8601 strings, which SQLite's date and time
+    # functions understand
+    "date": FieldType(datetime, to_scalar),
+    "dateTime": FieldType(datetime, to_scalar),
+    "createdTime": FieldType(datetime, to_scalar),
+    "lastModifiedTime": FieldType(datetime, to_scalar),
+    # fields holding lists or objects are stored as JSON, which can be
+    # queried with SQLite's JSON functions such as json_each
+    "multipleSelects": FieldType(list, to_json),
+    "multipleAttachments": FieldType(list, to_json),
+    "multipleCollaborators": FieldType(list, to_json),
+    "multipleLookupValues": FieldType(list, to_json),
+    "singleCollaborator": FieldType(dict, to_json),
+    "createdBy": FieldType(dict, to_json),
+    "lastModifiedBy": FieldType(dict, to_json),
+    "barcode": FieldType(dict, to_json),
+    "button": FieldType(dict, to_json),
+    "aiText": FieldType(dict, to_json),
+}
+DEFAULT_FIELD_TYPE = FieldType(str, to_scalar)
+
+
+def register_field_type(field_type: str, column_type: Any, convert: Converter) -> None:
+    """
+    Set how values from fields with this Airtable field type are stored,
+    replacing any existing converter for that type.
+    """
+    FIELD_TYPES[field_type] = FieldType(column_type, convert)
+
+
+def get_field_type(field_type: str) -> FieldType:
+    return FIELD_TYPES.get(field_type, DEFAULT_FIELD_TYPE)
+
+
+RowBuilder = Callable[[str, Any], Iterable[Tuple[Any, ...]]]
+
+
+class ChildTableType(NamedTuple):
+    # columns of the child table, after the "recordId" column
+    columns: Dict[str, Any]
+    # foreign keys from the child table, apart from the one to the record
+    foreign_keys: List[Tuple[str, str, str]]
+    # given the field's options, returns a function that turns the value of
+    # the field into rows of the child table
+    rows: Callable[[Optional[Dict[str, Any]]], RowBuilder]
+
+
+def link_rows(record_id: str, value: Any) -> Iterable[Tuple[Any, ...]]:
+    return ((record_id, linked_id) for linked_id in value)
+
+
+def select_rows(options: Optional[Dict[str, Any]]) -> RowBuilder:
+    # Airtable returns the names of the chosen options, rather than their IDs
+    choice_ids = {choice.get("name"): choice.get("id") for choice in (options or {}).get("choices", [])}
+
+    def rows(record_id: str, value: Any) -> Iterable[Tuple[Any, ...]]:
+        return ((record_id, choice_ids.get(name), name) for name in value)
+
+    return rows
+
+
+def attachment_rows(options: Optional[Dict[str, Any]]) -> RowBuilder:  # noqa: ARG001
+    def rows(record_id: str, value: Any) -> Iterable[Tuple[Any, ...]]:
+        return (
+            (
+                record_id,
+                attachment.get("id"),
+                attachment.get("url"),
+                attachment.get("filename"),
+                attachment.get("size"),
+                attachment.get("type"),
+                attachment.get("width"),
+                attachment.get("height"),
+                to_json(attachment.get("thumbnails")),
+            )
+            for attachment in value
+        )
+
+    return rows
+
+
+def collaborator_rows(options: Optional[Dict[str, Any]]) -> RowBuilder:  # noqa: ARG001
+    def rows(record_id: str, value: Any) -> Iterable[Tuple[Any, ...]]:
+        return ((record_id, user.get("id"), user.get("email"), user.get("name")) for user in value)
+
+    return rows
+
+
+# fields that can be stored in a child table with a row for each value,
+# instead of as JSON in the record's own table
+CHILD_TABLE_TYPES: Dict[str, ChildTableType] = {
+    "multipleSelects": ChildTableType(
+        columns={"choiceId": str, "name": str},
+        foreign_keys=[("choiceId", "_meta_field_choice", "id")],
+        rows=select_rows,
+    ),
+    "multipleAttachments": ChildTableType(
+        columns={
+            "id": str,
+            "url": str,
+            "filename": str,
+            "size": int,
+            "type": str,
+            "width": int,
+            "height": int,
+            "thumbnails": dict,
+        },
+        foreign_keys=[],
+        rows=attachment_rows,
+    ),
+    "multipleCollaborators": ChildTableType(
+        columns={"id": str, "email": str, "name": str},
+        foreign_keys=[],
+        rows=collaborator_rows,
+    ),
+}
+
+
+def get_child_table_type(field_type: str) -> Optional[ChildTableType]:
+    return CHILD_TABLE_TYPES.get(field_type)
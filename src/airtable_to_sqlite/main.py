@@ -1,29 +1,73 @@
+import contextlib
+import hashlib
+import json
 import logging
-from datetime import datetime
-from typing import Dict, Generator, List, Optional
+import os
+import queue
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import pyairtable.metadata
+import requests
 import sqlite_utils
 from pyairtable.api.api import Api as AirtableApi
+from pyairtable.utils import chunked
 from sqlite_utils import Database
 from tqdm import tqdm
 
+from airtable_to_sqlite.api import get_api, get_request_metrics
+from airtable_to_sqlite.attachments import AttachmentDownloader
+from airtable_to_sqlite.cache import ResponseCache
 from airtable_to_sqlite.constants import (
+    ATTACHMENT_TABLE,
+    BULK_LOAD_CACHE_SIZE,
+    BULK_LOAD_MMAP_SIZE,
+    CHECKPOINT_TABLE,
+    DEFAULT_ATTACHMENT_WORKERS,
+    DEFAULT_BATCH_SIZE,
+    INVALID_OFFSET_STATUS,
     META_TABLES,
+    SCHEMA_VERSION,
+    SQLITE_MAX_PARAMETERS,
+    TEMPORARY_FILE_SUFFIX,
     AirtablePersonalAccessToken,
     ForeignKeySet,
     PreferedNamingMethod,
 )
+from airtable_to_sqlite.converters import ChildTableType, RowBuilder, get_child_table_type, link_rows, record_hash
 from airtable_to_sqlite.schema import BaseRecord, FieldSchema, TableSchema, ViewSchema
+from airtable_to_sqlite.sinks import SINKS, Sink, SQLiteSink, quote_identifier
+from airtable_to_sqlite.stats import ExportHooks, ExportStats
 
 logger = logging.getLogger(__name__)
 
 
 def get_base_records(
-    personal_access_token: AirtablePersonalAccessToken, base_ids: Optional[List[str]] = None
+    personal_access_token: AirtablePersonalAccessToken,
+    base_ids: Optional[List[str]] = None,
+    cache: Optional[ResponseCache] = None,
+    api: Optional[AirtableApi] = None,
 ) -> Generator[BaseRecord, None, None]:
     logger.info("Fetching base record from Airtable...")
-    api = AirtableApi(personal_access_token)
+    if api is None:
+        api = get_api(personal_access_token, cache=cache)
     all_bases = pyairtable.metadata.get_api_bases(api)
 
     if base_ids is not None:
@@ -39,6 +83,152 @@ def get_base_records(
             yield BaseRecord(**base_record)
 
 
+def export_base(
+    personal_access_token: AirtablePersonalAccessToken,
+    base: BaseRecord,
+    database: str,
+    prefer_ids: PreferedNamingMethod = PreferedNamingMethod.NAME,
+    *,
+    incremental: bool = False,
+    resume: bool = False,
+    bulk_load: bool = False,
+    atomic_write: bool = False,
+    optimize: bool = False,
+    use_async: bool = False,
+    output_format: str = "sqlite",
+    **kwargs: Any,
+) -> ExportStats:
+    # the database connection is opened here rather than by the caller, so
+    # that each base can be exported from its own thread
+    logger.info(f"Exporting base {base.name} ({base.id}) to {database}")
+    exporter = AirtableBaseToSqlite
+    if use_async:
+        # imported here as the async exporter is built on this module
+        from airtable_to_sqlite.async_main import AsyncAirtableBaseToSqlite  # noqa: PLC0415
+
+        exporter = AsyncAirtableBaseToSqlite
+    if output_format in SINKS:
+        # the records are streamed to files in the output directory, and the
+        # metadata is kept in memory until they are all written. Options for
+        # the SQLite file itself don't apply.
+        db = Database(memory=True)
+        try:
+            stats = exporter(
+                personal_access_token,
+                db,
+                base,
+                prefer_ids,
+                incremental=incremental,
+                resume=resume,
+                sink=SINKS[output_format](database),
+                **kwargs,
+            ).run()
+        finally:
+            db.close()
+        logger.info(f"Finished exporting base {base.name} ({base.id}) in {stats.seconds:.1f} seconds")
+        return stats
+    output = database
+    if atomic_write:
+        # build the export next to the output file and rename it over the
+        # output at the end, so that readers never see a partly written file
+        database = output + TEMPORARY_FILE_SUFFIX
+    db = Database(database)
+    resuming = resume and db[CHECKPOINT_TABLE].exists()
+    if not resuming and (not incremental or database != output):
+        db.close()
+        db = Database(database, recreate=True)
+        if incremental and os.path.exists(output):
+            copy_database(output, db)
+    try:
+        with bulk_loading(db) if bulk_load else contextlib.nullcontext():
+            stats = exporter(
+                personal_access_token, db, base, prefer_ids, incremental=incremental, resume=resume, **kwargs
+            ).run()
+        if optimize:
+            logger.info(f"Optimising {database}")
+            db.analyze()
+            db.vacuum()
+    finally:
+        db.close()
+    if database != output:
+        os.replace(database, output)
+    logger.info(f"Finished exporting base {base.name} ({base.id}) in {stats.seconds:.1f} seconds")
+    return stats
+
+
+def copy_database(source: str, db: Database) -> None:
+    source_conn = sqlite3.connect(source)
+    try:
+        source_conn.backup(db.conn)
+    finally:
+        source_conn.close()
+
+
+@contextlib.contextmanager
+def bulk_loading(db: Database) -> Iterator[Database]:
+    """
+    Loads the whole database in a single transaction, with SQLite tuned for
+    speed rather than safety. Nothing is synced to disk until the end, so if
+    the process is interrupted the output file should be thrown away.
+    """
+    db.execute(f"PRAGMA cache_size = -{BULK_LOAD_CACHE_SIZE}")
+    db.execute(f"PRAGMA mmap_size = {BULK_LOAD_MMAP_SIZE}")
+    db.execute("PRAGMA synchronous = OFF")
+    db.enable_wal()
+    try:
+        # transactions opened inside this one become savepoints
+        with db.atomic():
+            yield db
+    finally:
+        # moving out of WAL mode copies the log back into the database file,
+        # which is synced to disk now that synchronous is back on
+        db.execute("PRAGMA synchronous = FULL")
+        db.disable_wal()
+
+
+class TablePage(NamedTuple):
+    table: TableSchema
+    records: List[Dict[str, Any]]
+    offset: Optional[str]
+
+
+class PageRows(NamedTuple):
+    # a page of records that has been turned into rows, ready to be written
+    table: TableSchema
+    records: List[Tuple[Any, ...]]
+    links: Dict[str, List[Tuple[Any, ...]]]
+    offset: Optional[str]
+    # the record ID, field ID and value of each attachment to download
+    attachments: Sequence[Tuple[str, str, Dict[str, Any]]] = ()
+
+
+class TableFinished(NamedTuple):
+    table: TableSchema
+    complete: bool = False
+    record_ids: Optional[Set[str]] = None
+
+
+class TablePlan(NamedTuple):
+    """
+    How the records from a table are turned into rows, worked out once per
+    table rather than for every record.
+    """
+
+    table_name: str
+    # columns of the table, starting with "_id", "_createdTime" and "_hash"
+    columns: Tuple[str, ...]
+    # the key in the record's fields and the converter for each field column
+    fields: Tuple[Tuple[str, Callable[[Any], Any]], ...]
+    # the key in the record's fields, the link table and a function giving
+    # the rows of the link table, for each field stored in a link table
+    link_fields: Tuple[Tuple[str, str, RowBuilder], ...]
+    # the key in the record's fields and the field ID, for each attachment
+    # field whose files are downloaded
+    attachment_fields: Tuple[Tuple[str, str], ...] = ()
+    # mixed into the hash of each record
+    fingerprint: str = ""
+
+
 class AirtableBaseToSqlite:
     def __init__(
         self,
@@ -46,32 +236,147 @@ class AirtableBaseToSqlite:
         db: Database,
         base: BaseRecord,
         prefer_ids: PreferedNamingMethod = PreferedNamingMethod.NAME,
+        *,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        concurrency: int = 1,
+        incremental: bool = False,
+        cache: Optional[ResponseCache] = None,
+        api: Optional[AirtableApi] = None,
+        resume: bool = False,
+        index_fields: Sequence[Tuple[str, str]] = (),
+        child_tables: bool = False,
+        only_tables: Sequence[str] = (),
+        only_fields: Sequence[Tuple[str, str]] = (),
+        views: Sequence[Tuple[str, str]] = (),
+        formulas: Sequence[Tuple[str, str]] = (),
+        hooks: Sequence[ExportHooks] = (),
+        download_attachments: bool = False,
+        attachments_dir: Optional[str] = None,
+        attachment_workers: int = DEFAULT_ATTACHMENT_WORKERS,
+        sink: Optional[Sink] = None,
     ) -> None:
         self._base: BaseRecord = base
+        # the database holds the metadata tables and checkpoints. Records are
+        # written to the sink, which is the same database by default.
         self._db: Database = db
-        self._api = AirtableApi(personal_access_token)
+        self.sink = sink if sink is not None else SQLiteSink(db)
+        if self.sink.database is None and (incremental or resume):
+            msg = "Incremental updates and resuming are only possible when exporting to SQLite"
+            raise ValueError(msg)
+        if self.sink.database is None and download_attachments and attachments_dir is None:
+            msg = "Attachments can only be stored in a directory when not exporting to SQLite"
+            raise ValueError(msg)
+        # an API client can be shared between bases, so that they use the
+        # same pool of connections
+        self._api = api if api is not None else get_api(personal_access_token, cache=cache)
         self._base_api = self._api.base(base.id)
         self.prefer_ids = prefer_ids
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.incremental = incremental
+        self.resume = resume
+        self.index_fields = index_fields
+        self.child_tables = child_tables
+        # tables and fields can be given using either their names or IDs
+        self.only_tables = only_tables
+        self.only_fields = only_fields
+        self.views = views
+        self.formulas = formulas
+        self.table_options: Dict[str, Dict[str, Any]] = {}
         self.foreign_keys: ForeignKeySet = set()
         self.table_meta: List[TableSchema] = []
         self.table_id_lookup: Dict[str, str] = {}
+        self.table_fingerprints: Dict[str, str] = {}
         self.meta_tables: Dict[str, sqlite_utils.db.Table] = {}
+        # link tables hold the links for each link field, and the values of
+        # fields that are stored in child tables
+        self.link_tables: Dict[str, sqlite_utils.db.Table] = {}
+        self.link_table_columns: Dict[str, Tuple[str, ...]] = {}
+        self.table_link_tables: Dict[str, List[str]] = defaultdict(list)
+        self.table_plans: Dict[str, TablePlan] = {}
+        self._record_rows: Dict[str, List[Tuple[Any, ...]]] = defaultdict(list)
+        self._link_rows: Dict[str, List[Tuple[Any, ...]]] = defaultdict(list)
+        self.checkpoint_table: Optional[sqlite_utils.db.Table] = None
+        self.checkpoints: Dict[str, Dict[str, Any]] = {}
+        self.upsert_tables: Set[str] = set()
+        self._pending_offsets: Dict[str, Optional[str]] = {}
+        self.link_table_owners: Dict[str, str] = {}
+        self.attachments: Optional[AttachmentDownloader] = None
+        if download_attachments:
+            self.attachments = AttachmentDownloader(db, attachments_dir, workers=attachment_workers)
+        self.stats = ExportStats(base.id, base.name, request_metrics=get_request_metrics(self._api), hooks=hooks)
 
-    def run(self) -> None:
-        self.get_schema()
-        self.create_metadata_tables()
-        self.create_all_table_metadata()
-        self.create_foreign_keys()
-        self.insert_settings()
-        self.insert_all_table_data()
+    def run(self) -> ExportStats:
+        try:
+            self.run_phases()
+        finally:
+            if self.attachments is not None:
+                self.attachments.close()
+                self.stats.attachments = dict(self.attachments.counts)
+            self.sink.finalize()
+        self.stats.finish()
+        return self.stats
+
+    def run_phases(self) -> None:
+        with self.stats.phase("get_schema"):
+            self.get_schema()
+        if self.resume and self.load_checkpoints():
+            logger.info("Resuming export from the last checkpoint")
+            with self.stats.phase("open_metadata_tables"):
+                self.open_metadata_tables()
+        elif self.incremental and self.has_schema_fingerprint():
+            with self.stats.phase("migrate_schema"):
+                self.migrate_schema()
+            with self.stats.phase("insert_settings"):
+                self.insert_settings()
+            with self.stats.phase("create_checkpoint_table"):
+                self.create_checkpoint_table()
+        else:
+            with self.stats.phase("create_metadata_tables"):
+                self.create_metadata_tables()
+            with self.stats.phase("create_all_table_metadata"):
+                self.create_all_table_metadata()
+            if self.sink.database is not None:
+                with self.stats.phase("create_foreign_keys"):
+                    self.create_foreign_keys()
+            with self.stats.phase("insert_settings"):
+                self.insert_settings()
+            with self.stats.phase("create_checkpoint_table"):
+                self.create_checkpoint_table()
+        if self.attachments is not None:
+            self.attachments.create_tables()
+        with self.stats.phase("insert_all_table_data"):
+            self.insert_all_table_data()
+        if self.attachments is not None:
+            # downloads run alongside fetching the records, this waits for
+            # any that are still going
+            with self.stats.phase("download_attachments"), self._db.atomic():
+                self.attachments.finish()
+        if self.sink.database is not None:
+            with self.stats.phase("create_indexes"):
+                self.create_indexes()
+        with self.stats.phase("remove_checkpoint_table"):
+            self.remove_checkpoint_table()
+        if self.sink.database is None:
+            with self.stats.phase("write_metadata_tables"):
+                self.write_metadata_tables()
 
     def get_schema(self) -> None:
         logger.info("Fetching schema from Airtable...")
         tables = pyairtable.metadata.get_base_schema(self._base_api)
         for table in tables["tables"]:
+            table_keys = (table["id"], table["name"])
+            if self.only_tables and not any(key in table_keys for key in self.only_tables):
+                continue
+            field_keys = [field_key for table_key, field_key in self.only_fields if table_key in table_keys]
             fields = []
             for field in table["fields"]:
+                if field_keys and field["id"] not in field_keys and field["name"] not in field_keys:
+                    continue
                 fields.append(FieldSchema(**field))
+            for field_key in field_keys:
+                if not any(field_key in (field.id, field.name) for field in fields):
+                    logger.warning(f"Not exporting {table['name']}.{field_key} as it isn't in base {self._base.id}")
             views = []
             for view in table["views"]:
                 views.append(ViewSchema(**view))
@@ -80,12 +385,87 @@ class AirtableBaseToSqlite:
             )
             self.table_meta.append(this_table)
             self.table_id_lookup[this_table.id] = this_table.db_name(self.prefer_ids)
+            # how fields are stored depends on these options as well as the schema
+            self.table_fingerprints[this_table.id] = this_table.fingerprint(
+                SCHEMA_VERSION, self.prefer_ids.name, str(self.child_tables)
+            )
+            self.table_options[this_table.id] = self.get_table_options(table_keys, fields if field_keys else None)
+            if self.table_options[this_table.id].get("fields") == []:
+                # Airtable returns every field if none are given, so only the
+                # primary field is asked for, although it isn't saved
+                self.table_options[this_table.id]["fields"] = [this_table.primaryFieldId]
+            for field in this_table.fields:
+                if (field.type == "multipleRecordLinks") and field.options is not None:
+                    columns: Tuple[str, ...] = ("recordId", "otherRecordId")
+                else:
+                    child_table_type = self.get_child_table_type(field)
+                    if child_table_type is None:
+                        continue
+                    columns = ("recordId", *child_table_type.columns)
+                link_table_name = self.get_link_table(field, this_table).name
+                self.table_link_tables[this_table.db_name(self.prefer_ids)].append(link_table_name)
+                self.link_table_owners[link_table_name] = this_table.db_name(self.prefer_ids)
+                self.link_table_columns[link_table_name] = columns
+        self.warn_unmatched_tables([(table["id"], table["name"]) for table in tables["tables"]])
+
+    def warn_unmatched_tables(self, all_table_keys: List[Tuple[str, str]]) -> None:
+        # a mistyped table would otherwise silently leave out a table, or
+        # export everything instead of a filtered set of records
+        exported_keys = [(table.id, table.name) for table in self.table_meta]
+        for table_key in self.only_tables:
+            if not any(table_key in table_keys for table_keys in all_table_keys):
+                logger.warning(f"Not exporting table {table_key} as it isn't in base {self._base.id}")
+        options = [
+            *(("field", table_key, field_key) for table_key, field_key in self.only_fields),
+            *(("view", table_key, view) for table_key, view in self.views),
+            *(("formula", table_key, formula) for table_key, formula in self.formulas),
+        ]
+        for option, table_key, value in options:
+            if not any(table_key in table_keys for table_keys in exported_keys):
+                logger.warning(
+                    f"Ignoring {option} {value} for table {table_key} as it isn't exported from base {self._base.id}"
+                )
+
+    @property
+    def schema_fingerprint(self) -> str:
+        content = "\n".join(
+            f"{table_id}:{fingerprint}" for table_id, fingerprint in sorted(self.table_fingerprints.items())
+        )
+        return hashlib.sha256(content.encode("utf8")).hexdigest()
+
+    def get_table_options(
+        self, table_keys: Tuple[str, str], fields: Optional[List[FieldSchema]] = None
+    ) -> Dict[str, Any]:
+        # these options are sent to Airtable, so that it only returns the
+        # records and fields that will be saved
+        options: Dict[str, Any] = {}
+        if fields is not None:
+            options["fields"] = [field.id for field in fields]
+        for table_key, view in self.views:
+            if table_key in table_keys:
+                options["view"] = view
+        for table_key, formula in self.formulas:
+            if table_key in table_keys:
+                options["formula"] = formula
+        return options
+
+    def get_child_table_type(self, field: FieldSchema) -> Optional[ChildTableType]:
+        if not self.child_tables:
+            return None
+        return get_child_table_type(field.type)
 
     def create_metadata_tables(self) -> None:
         for table_name, (columns, options) in META_TABLES.items():
             options_to_use = options.copy()
             for foreign_key in options_to_use.pop("foreign_keys", []):
                 self.foreign_keys.add((table_name, foreign_key))
+            if self.incremental:
+                # settings are kept between incremental runs as they hold the
+                # time each table was last synced
+                if table_name == "_meta_settings":
+                    options_to_use["ignore"] = True
+                else:
+                    options_to_use["replace"] = True
             db_table = self._db.table(table_name)
             if isinstance(db_table, sqlite_utils.db.Table):
                 db_table.create(columns=columns, **options_to_use)
@@ -94,12 +474,22 @@ class AirtableBaseToSqlite:
                 pass
 
     def create_all_table_metadata(self) -> None:
-        for table in tqdm(self.table_meta):
+        for table in tqdm(self.table_meta, desc=self._base.name):
             self.create_table_metadata(table)
 
     def get_link_table(self, field: FieldSchema, table: TableSchema) -> sqlite_utils.db.Table:
         new_table_name = table.db_name(self.prefer_ids) + "_" + field.id
-        return sqlite_utils.db.Table(self._db, new_table_name)
+        if new_table_name not in self.link_tables:
+            self.link_tables[new_table_name] = sqlite_utils.db.Table(self._db, new_table_name)
+        return self.link_tables[new_table_name]
+
+    def flush_link_rows(self, table_name: Optional[str] = None) -> None:
+        table_names = list(self._link_rows.keys()) if table_name is None else [table_name]
+        for name in table_names:
+            rows = self._link_rows.pop(name, [])
+            if rows:
+                self.sink.write_link_rows(name, self.link_table_columns[name], rows)
+                self.stats.add_link_rows(self.link_table_owners[name], len(rows))
 
     def create_table_metadata(
         self,
@@ -117,6 +507,7 @@ class AirtableBaseToSqlite:
         column_types = {
             "_id": str,
             "_createdTime": datetime,
+            "_hash": str,
         }
         fields_to_insert = []
         for field in table.fields:
@@ -131,29 +522,29 @@ class AirtableBaseToSqlite:
             if (field.type == "multipleRecordLinks") and field.options is not None:
                 link_db_table = self.get_link_table(field, table)
                 other_table = field.options["linkedTableId"]
-                other_table_name = self.table_id_lookup.get(other_table, other_table)
                 self.foreign_keys.add((link_db_table.name, ("recordId", table_name, "_id")))
-                self.foreign_keys.add((link_db_table.name, ("otherRecordId", other_table_name, "_id")))
-                if isinstance(link_db_table, sqlite_utils.db.Table):
-                    link_db_table.create(
-                        columns={
-                            "recordId": str,
-                            "otherRecordId": str,
-                        },
-                    )
-                else:  # pragma: no cover
-                    pass
+                # the linked table may have been left out of the export
+                if other_table in self.table_id_lookup:
+                    other_table_name = self.table_id_lookup[other_table]
+                    self.foreign_keys.add((link_db_table.name, ("otherRecordId", other_table_name, "_id")))
+                self.create_table(table, link_db_table.name, {"recordId": str, "otherRecordId": str})
+                continue
+
+            child_table_type = self.get_child_table_type(field)
+            if child_table_type is not None:
+                child_db_table = self.get_link_table(field, table)
+                self.foreign_keys.add((child_db_table.name, ("recordId", table_name, "_id")))
+                for foreign_key in child_table_type.foreign_keys:
+                    self.foreign_keys.add((child_db_table.name, foreign_key))
+                self.create_table(table, child_db_table.name, {"recordId": str, **child_table_type.columns})
+                continue
 
             column_type = field.column_type
             if column_type is not None:
                 column_types[field_name] = column_type
 
         self.meta_tables["_meta_field"].insert_all(fields_to_insert)
-        db_table = self._db.table(table_name)
-        if isinstance(db_table, sqlite_utils.db.Table):
-            db_table.create(columns=column_types, pk="_id")
-        else:  # pragma: no cover
-            pass
+        self.create_table(table, table_name, column_types, pk="_id")
 
         self.meta_tables["_meta_view"].insert_all(
             {
@@ -165,16 +556,76 @@ class AirtableBaseToSqlite:
             for view in table.views
         )
 
+    def create_table(
+        self, table: TableSchema, table_name: str, columns: Dict[str, Any], *, pk: Optional[str] = None
+    ) -> None:
+        # records fetched by an earlier incremental run aren't in a table or
+        # column that is new, so the whole Airtable table is fetched again.
+        # The time it was last synced is removed rather than ignored, so
+        # that this still happens if the export fails before then.
+        if self.incremental and self.sink.database is not None:
+            db_table = self.sink.database.table(table_name)
+            if not db_table.exists() or not set(columns) <= set(db_table.columns_dict):
+                self.meta_tables["_meta_settings"].delete_where("key = ?", [f"last_synced:{table.id}"])
+        self.sink.create_table(table_name, columns, pk=pk)
+
     def create_foreign_keys(self) -> None:
         logger.info("Adding foreign keys")
-        for table_name, foreign_key in self.foreign_keys:
-            db_table = self._db[table_name]
-            if isinstance(db_table, sqlite_utils.db.Table):
-                db_table.add_foreign_key(*foreign_key)
-            else:  # pragma: no cover
-                pass
+        # sqlite-utils rebuilds a table to change its foreign keys, so they
+        # are all added together to rebuild each table at most once. Keys
+        # that already exist are skipped. Running inside a transaction
+        # stops sqlite-utils from vacuuming the database afterwards.
+        with self._db.atomic():
+            self._db.add_foreign_keys(
+                [(table_name, *foreign_key) for table_name, foreign_key in sorted(self.foreign_keys)]
+            )
         self.foreign_keys = set()
 
+    def create_indexes(self) -> None:
+        logger.info("Adding indexes")
+        # indexes are added once all the records have been inserted, which is
+        # quicker than keeping them up to date while the tables are loaded
+        with self._db.atomic():
+            self._db.index_foreign_keys()
+            for table_name, column in self.get_index_columns():
+                db_table = self._db[table_name]
+                if isinstance(db_table, sqlite_utils.db.Table):
+                    db_table.create_index([column], if_not_exists=True)
+                else:  # pragma: no cover
+                    pass
+
+    def get_index_columns(self) -> List[Tuple[str, str]]:
+        # fields to index can be given using either the names or IDs of the
+        # table and field
+        index_columns = []
+        for table_key, field_key in self.index_fields:
+            table = next((t for t in self.table_meta if table_key in (t.id, t.name)), None)
+            field = None
+            if table is not None:
+                field = next((f for f in table.fields if field_key in (f.id, f.name)), None)
+            if table is None or field is None:
+                logger.warning(f"Not indexing {table_key}.{field_key} as it isn't in base {self._base.id}")
+                continue
+            table_name = table.db_name(self.prefer_ids)
+            column = field.db_name(self.prefer_ids)
+            if column not in self._db[table_name].columns_dict:
+                logger.warning(f"Not indexing {table_key}.{field_key} as it isn't stored as a column")
+                continue
+            index_columns.append((table_name, column))
+        return index_columns
+
+    def write_metadata_tables(self) -> None:
+        # when the records are written somewhere other than SQLite, the
+        # metadata is kept in the exporter's own database until the end
+        for table_name in [*META_TABLES, ATTACHMENT_TABLE]:
+            db_table = self._db.table(table_name)
+            if not isinstance(db_table, sqlite_utils.db.Table) or not db_table.exists():
+                continue
+            columns = db_table.columns_dict
+            self.sink.create_table(table_name, columns)
+            for rows in chunked(list(db_table.rows), self.batch_size):
+                self.sink.write_rows(table_name, list(columns), [tuple(row.values()) for row in rows])
+
     def insert_settings(self) -> None:
         self.meta_tables["_meta_settings"].insert_all(
             [
@@ -194,44 +645,503 @@ class AirtableBaseToSqlite:
                     "key": "prefer_ids",
                     "value": self.prefer_ids.name,
                 },
-            ]
+                {
+                    "key": "schema_fingerprint",
+                    "value": self.schema_fingerprint,
+                },
+                *(
+                    {"key": f"schema_fingerprint:{table_id}", "value": fingerprint}
+                    for table_id, fingerprint in self.table_fingerprints.items()
+                ),
+            ],
+            replace=True,
         )
 
+    def get_setting(self, key: str) -> Optional[str]:
+        for row in self.meta_tables["_meta_settings"].rows_where("key = ?", [key]):
+            return row["value"]
+        return None
+
+    def has_schema_fingerprint(self) -> bool:
+        # databases from before fingerprints were stored have all their
+        # tables created again
+        self.open_metadata_tables()
+        return self.get_setting("schema_fingerprint") is not None
+
+    def get_stored_fingerprints(self) -> Dict[str, str]:
+        prefix = "schema_fingerprint:"
+        return {
+            row["key"][len(prefix) :]: row["value"]
+            for row in self.meta_tables["_meta_settings"].rows
+            if row["key"].startswith(prefix)
+        }
+
+    def migrate_schema(self) -> None:
+        # the tables from the last export are updated in place, and only the
+        # tables whose schema has changed since then are touched
+        stored_fingerprints = self.get_stored_fingerprints()
+        tables_to_migrate = [
+            table
+            for table in self.table_meta
+            if stored_fingerprints.get(table.id) != self.table_fingerprints[table.id] or self.is_missing_tables(table)
+        ]
+        if self.get_setting("schema_fingerprint") == self.schema_fingerprint and not tables_to_migrate:
+            logger.info("Schema is unchanged since the last export")
+            return
+        with self._db.atomic():
+            for table_id in sorted(stored_fingerprints.keys() - self.table_fingerprints.keys()):
+                # the table's records are kept, as it may only have been left
+                # out of this export
+                logger.info(f"Removing the metadata for table {table_id} as it is no longer exported")
+                self.remove_table_metadata(table_id)
+                self.meta_tables["_meta_settings"].delete_where(
+                    "key in (?, ?, ?)",
+                    [f"last_synced:{table_id}", f"filters:{table_id}", f"schema_fingerprint:{table_id}"],
+                )
+            for table in tables_to_migrate:
+                logger.info(f"Updating the tables for {table.name} as its schema has changed")
+                self.migrate_table(table)
+        if self.foreign_keys:
+            self.create_foreign_keys()
+
+    def is_missing_tables(self, table: TableSchema) -> bool:
+        # tables can also have been removed by hand since the last export
+        table_name = table.db_name(self.prefer_ids)
+        return any(not self._db[name].exists() for name in [table_name, *self.table_link_tables.get(table_name, [])])
+
+    def migrate_table(self, table: TableSchema) -> None:
+        # tables and columns were named using the naming method of the last
+        # export, which may be different
+        stored_naming = self.get_setting("prefer_ids")
+        stored_prefer_ids = PreferedNamingMethod[stored_naming] if stored_naming else self.prefer_ids
+        table_name = table.db_name(self.prefer_ids)
+        stored_table = next(self.meta_tables["_meta_table"].rows_where("id = ?", [table.id]), None)
+        stored_fields = {
+            row["id"]: row for row in self.meta_tables["_meta_field"].rows_where("tableId = ?", [table.id])
+        }
+        if stored_table is not None:
+            stored_name = table.id if stored_prefer_ids == PreferedNamingMethod.ID else stored_table["name"]
+            if stored_name != table_name:
+                self.rename_table(stored_name, table_name, list(stored_fields))
+        for field in table.fields:
+            stored_field = stored_fields.get(field.id)
+            if stored_field is None:
+                continue
+            stored_column = field.id if stored_prefer_ids == PreferedNamingMethod.ID else stored_field["name"]
+            if stored_column != field.db_name(self.prefer_ids):
+                self.rename_column(table_name, stored_column, field.db_name(self.prefer_ids))
+        # columns for fields that have been removed are kept, as dropping
+        # them means rewriting the table, but their link tables are dropped
+        for field_id in stored_fields:
+            link_table_name = table_name + "_" + field_id
+            if link_table_name not in self.link_table_columns and self._db[link_table_name].exists():
+                logger.info(f"Removing {link_table_name} as its field is no longer exported")
+                self._db[link_table_name].drop()
+        self.remove_table_metadata(table.id)
+        self.create_table_metadata(table)
+
+    def rename_table(self, old_name: str, new_name: str, field_ids: List[str]) -> None:
+        for field_id in field_ids:
+            self.rename_table(old_name + "_" + field_id, new_name + "_" + field_id, [])
+        if not self._db[old_name].exists() or self._db[new_name].exists():
+            return
+        logger.info(f"Renaming table {old_name} to {new_name}")
+        self._db.rename_table(old_name, new_name)
+
+    def rename_column(self, table_name: str, old_name: str, new_name: str) -> None:
+        columns = self._db[table_name].columns_dict
+        if old_name not in columns or new_name in columns:
+            return
+        logger.info(f"Renaming column {old_name} in {table_name} to {new_name}")
+        self._db.execute(
+            f"ALTER TABLE {quote_identifier(table_name)} "
+            f"RENAME COLUMN {quote_identifier(old_name)} TO {quote_identifier(new_name)}"
+        )
+
+    def remove_table_metadata(self, table_id: str) -> None:
+        self.meta_tables["_meta_field_choice"].delete_where(
+            "fieldId in (select id from _meta_field where tableId = ?)", [table_id]
+        )
+        self.meta_tables["_meta_field"].delete_where("tableId = ?", [table_id])
+        self.meta_tables["_meta_view"].delete_where("tableId = ?", [table_id])
+        self.meta_tables["_meta_table"].delete_where("id = ?", [table_id])
+
+    def get_fetch_options(self, table: TableSchema) -> Dict[str, Any]:
+        options = dict(self.table_options.get(table.id, {}))
+        if not self.incremental:
+            return options
+        last_synced = self.get_setting(f"last_synced:{table.id}")
+        if last_synced is None:
+            return options
+        if self.get_setting(f"filters:{table.id}") != json.dumps(self.get_filters(table), sort_keys=True):
+            # records that weren't in the view or didn't match the formula
+            # last time may do now, even if they haven't been modified
+            logger.info(f"Fetching all records in {table.name} as its view or formula has changed")
+            return options
+        logger.info(f"Fetching records in {table.name} modified since {last_synced}")
+        formula = f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{last_synced}'))"
+        if "formula" in options:
+            formula = f"AND({options['formula']}, {formula})"
+        options["formula"] = formula
+        return options
+
+    def get_record_ids(self, table: TableSchema) -> Set[str]:
+        # records that are no longer in the chosen view or don't match the
+        # chosen formula are removed, along with deleted records
+        return table.get_record_ids(self._base_api, **self.get_filters(table))
+
+    def get_filters(self, table: TableSchema) -> Dict[str, Any]:
+        options = self.table_options.get(table.id, {})
+        return {key: options[key] for key in ("view", "formula") if key in options}
+
+    def create_checkpoint_table(self) -> None:
+        # created once all the tables are in place, so its presence means an
+        # export can be resumed without creating the tables again
+        db_table = self._db.table(CHECKPOINT_TABLE)
+        if isinstance(db_table, sqlite_utils.db.Table):
+            db_table.create(
+                columns={
+                    "tableId": str,
+                    "offset": str,
+                    "complete": bool,
+                },
+                pk="tableId",
+                replace=True,
+            )
+            self.checkpoint_table = db_table
+        else:  # pragma: no cover
+            pass
+
+    def load_checkpoints(self) -> bool:
+        db_table = self._db.table(CHECKPOINT_TABLE)
+        if not isinstance(db_table, sqlite_utils.db.Table) or not db_table.exists():
+            return False
+        self.checkpoint_table = db_table
+        self.checkpoints = {row["tableId"]: row for row in db_table.rows}
+        # the page that was being fetched when the export stopped may have
+        # been partly written, so rows in unfinished tables are replaced
+        for table in self.table_meta:
+            checkpoint = self.checkpoints.get(table.id)
+            if checkpoint is None or not checkpoint["complete"]:
+                self.upsert_tables.add(table.db_name(self.prefer_ids))
+        return True
+
+    def open_metadata_tables(self) -> None:
+        for table_name in META_TABLES:
+            db_table = self._db.table(table_name)
+            if isinstance(db_table, sqlite_utils.db.Table):
+                self.meta_tables[table_name] = db_table
+            else:  # pragma: no cover
+                pass
+
+    def remove_checkpoint_table(self) -> None:
+        if self.checkpoint_table is not None:
+            self.checkpoint_table.drop()
+            self.checkpoint_table = None
+
+    def save_checkpoints(self, *, complete: bool = False) -> None:
+        if self.checkpoint_table is not None and self._pending_offsets:
+            self.checkpoint_table.insert_all(
+                (
+                    {"tableId": table_id, "offset": offset, "complete": complete}
+                    for table_id, offset in self._pending_offsets.items()
+                ),
+                replace=True,
+            )
+        self._pending_offsets = {}
+
+    def flush(self) -> None:
+        # buffered rows are written in the same transaction as the checkpoint
+        # for each table, so a resumed export carries on from the page after
+        # the last one that was saved
+        with self._db.atomic():
+            self.flush_records()
+            self.flush_link_rows()
+            if self.attachments is not None:
+                self.attachments.write_finished()
+            self.save_checkpoints()
+
+    def finish_table(self, table: TableSchema, sync_started: datetime, record_ids: Optional[Set[str]]) -> None:
+        with self._db.atomic():
+            self.flush()
+            if self.incremental and record_ids is not None:
+                self.delete_missing_records(table, record_ids)
+                # the view and formula are saved with the sync time, as only
+                # records matching them were fetched
+                self.meta_tables["_meta_settings"].insert_all(
+                    [
+                        {"key": f"last_synced:{table.id}", "value": sync_started.isoformat()},
+                        {"key": f"filters:{table.id}", "value": json.dumps(self.get_filters(table), sort_keys=True)},
+                    ],
+                    replace=True,
+                )
+            self._pending_offsets[table.id] = None
+            self.save_checkpoints(complete=True)
+        table_name = table.db_name(self.prefer_ids)
+        if self.incremental:
+            table_stats = self.stats.table(table_name)
+            logger.info(
+                f"{table.name}: {table_stats.records} records changed, "
+                f"{table_stats.unchanged} unchanged, {table_stats.deleted} deleted"
+            )
+        self.stats.table_finished(table_name)
+
+    def delete_missing_records(self, table: TableSchema, record_ids: Set[str]) -> None:
+        table_name = table.db_name(self.prefer_ids)
+        db_table = self._db.table(table_name)
+        if not isinstance(db_table, sqlite_utils.db.Table):  # pragma: no cover
+            return
+        deleted = [row["_id"] for row in db_table.rows_where(select="_id") if row["_id"] not in record_ids]
+        if deleted:
+            logger.info(f"Removing {len(deleted)} deleted records from {table.name}")
+            self.stats.add_deleted(table_name, len(deleted))
+        for chunk in chunked(deleted, SQLITE_MAX_PARAMETERS):
+            placeholders = ", ".join("?" for _ in chunk)
+            db_table.delete_where(f"_id in ({placeholders})", chunk)
+        self.delete_link_rows(table_name, deleted)
+
+    def delete_link_rows(self, table_name: str, record_ids: List[str], *, flush: bool = False) -> None:
+        for link_table_name in self.table_link_tables.get(table_name, []):
+            for chunk in chunked(record_ids, SQLITE_MAX_PARAMETERS):
+                placeholders = ", ".join("?" for _ in chunk)
+                self.link_tables[link_table_name].delete_where(f"recordId in ({placeholders})", chunk)
+            if flush:
+                self.flush_link_rows(link_table_name)
+
     def insert_all_table_data(self) -> None:
         logger.info("Fetching table data")
+        if self.concurrency > 1:
+            self.insert_all_table_data_concurrently()
+            return
         for table in self.table_meta:
             self.insert_table_data(table)
 
+    def tables_to_fetch(self) -> List[TableSchema]:
+        tables = []
+        for table in self.table_meta:
+            checkpoint = self.checkpoints.get(table.id)
+            if checkpoint is not None and checkpoint["complete"]:
+                logger.info(f"Skipping {table.name} as it was completed in a previous run")
+                continue
+            tables.append(table)
+        return tables
+
+    def insert_all_table_data_concurrently(self) -> None:
+        # pages for several tables are fetched at once by a pool of threads,
+        # which all share the rate limit for the base. Pages are passed back
+        # through a queue so that only this thread writes to the database.
+        pages: queue.Queue[Union[TablePage, TableFinished]] = queue.Queue(maxsize=self.concurrency * 2)
+        stop = threading.Event()
+        sync_started = datetime.now(timezone.utc)
+        tables = self.tables_to_fetch()
+        fetch_options = {table.id: self.get_fetch_options(table) for table in tables}
+        offsets = {table.id: self.checkpoints.get(table.id, {}).get("offset") for table in tables}
+
+        def fetch_table(table: TableSchema) -> None:
+            finished = TableFinished(table)
+            try:
+                for records, next_offset in self.fetch_table_pages(table, offsets[table.id], **fetch_options[table.id]):
+                    if stop.is_set():
+                        return
+                    pages.put(TablePage(table, records, next_offset))
+                record_ids = self.get_record_ids(table) if self.incremental else None
+                finished = TableFinished(table, complete=True, record_ids=record_ids)
+            finally:
+                pages.put(finished)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(fetch_table, table) for table in tables]
+            tables_remaining = len(futures)
+            progress = tqdm(desc=self._base.name, unit=" records")
+            try:
+                while tables_remaining:
+                    item = pages.get()
+                    if isinstance(item, TableFinished):
+                        tables_remaining -= 1
+                        if item.complete:
+                            self.finish_table(item.table, sync_started, item.record_ids)
+                        continue
+                    self.add_page(item.table, item.records, item.offset)
+                    progress.update(len(item.records))
+                self.flush()
+            except BaseException:
+                # keep draining the queue so that no fetching thread is left
+                # blocked, otherwise the executor would never shut down
+                stop.set()
+                while not all(future.done() for future in futures):
+                    try:
+                        pages.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                raise
+            finally:
+                progress.close()
+            for future in futures:
+                future.result()
+
+    def fetch_table_pages(
+        self, table: TableSchema, offset: Optional[str] = None, **options: Any
+    ) -> Generator[Tuple[List[Dict[str, Any]], Optional[str]], None, None]:
+        logger.info(f"Fetching table data for {table.name} from Airtable...")
+        self.stats.table_started(table.db_name(self.prefer_ids))
+        pages = table.iterate_pages(self._base_api, offset=offset, **options)
+        try:
+            first_page = next(pages, None)
+        except requests.HTTPError as error:
+            # Airtable only keeps pagination offsets for a limited time
+            if offset is None or error.response is None or error.response.status_code != INVALID_OFFSET_STATUS:
+                raise
+            logger.warning(f"Could not resume {table.name} from the checkpoint, fetching all records again")
+            pages = table.iterate_pages(self._base_api, **options)
+            first_page = next(pages, None)
+        if first_page is not None:
+            yield first_page
+            yield from pages
+
     def insert_table_data(self, table: TableSchema) -> None:
-        # get table records and insert
-        table_data = table.get_table_data(self._base_api)
-        table_name = table.db_name(self.prefer_ids)
-        db_table = self._db.table(table_name)
+        # get table records and insert them as they arrive, so that only
+        # one batch of records is held in memory at a time
+        checkpoint = self.checkpoints.get(table.id, {})
+        if checkpoint.get("complete"):
+            logger.info(f"Skipping {table.name} as it was completed in a previous run")
+            return
+        sync_started = datetime.now(timezone.utc)
+        fetch_options = self.get_fetch_options(table)
+        # bases exported alongside each other write their progress bars to
+        # the same terminal, so each bar says which base it is for
+        with tqdm(desc=f"{self._base.name}: {table.name}", unit=" records") as progress:
+            for records, next_offset in self.fetch_table_pages(table, checkpoint.get("offset"), **fetch_options):
+                self.add_page(table, records, next_offset)
+                progress.update(len(records))
+        record_ids = self.get_record_ids(table) if self.incremental else None
+        self.finish_table(table, sync_started, record_ids)
 
-        records_to_save = []
-        for record in tqdm(table_data):
-            record_to_save = {
-                "_id": record["id"],
-                "_createdTime": record["createdTime"],
-            }
+    def add_page(self, table: TableSchema, records: List[Dict[str, Any]], next_offset: Optional[str]) -> None:
+        self.add_page_rows(self.transform_page(table, records, next_offset))
+
+    def transform_page(self, table: TableSchema, records: List[Dict[str, Any]], next_offset: Optional[str]) -> PageRows:
+        plan = self.get_table_plan(table)
+        links: Dict[str, List[Tuple[Any, ...]]] = defaultdict(list)
+        rows = [self.transform_record(plan, record, links) for record in records]
+        attachments = [
+            (record["id"], field_id, attachment)
+            for record in records
+            for field_key, field_id in plan.attachment_fields
+            for attachment in record["fields"].get(field_key) or []
+        ]
+        return PageRows(table, rows, links, next_offset, attachments)
+
+    def add_page_rows(self, page: PageRows) -> None:
+        table = page.table
+        self._record_rows[self.get_table_plan(table).table_name].extend(page.records)
+        for link_table_name, rows in page.links.items():
+            self._link_rows[link_table_name].extend(rows)
+        if self.attachments is not None:
+            for record_id, field_id, attachment in page.attachments:
+                self.attachments.submit(record_id, field_id, attachment)
+        next_offset = page.offset
+        # the last page of a table has no offset, that table is marked as
+        # complete by finish_table instead
+        if next_offset is not None:
+            self._pending_offsets[table.id] = next_offset
+        buffered_rows = sum(len(rows) for rows in self._record_rows.values()) + sum(
+            len(rows) for rows in self._link_rows.values()
+        )
+        if buffered_rows >= self.batch_size:
+            self.flush()
+
+    def get_table_plan(self, table: TableSchema) -> TablePlan:
+        if table.id not in self.table_plans:
+            columns = ["_id", "_createdTime", "_hash"]
+            fields = []
+            link_fields: List[Tuple[str, str, RowBuilder]] = []
+            attachment_fields = []
             for field in table.fields:
+                if self.attachments is not None and field.type == "multipleAttachments":
+                    attachment_fields.append((field.name, field.id))
+                child_table_type = self.get_child_table_type(field)
                 if field.type == "multipleRecordLinks":
-                    link_db_table = self.get_link_table(field, table)
-                    if isinstance(link_db_table, sqlite_utils.db.Table):
-                        link_db_table.insert_all(
-                            {
-                                "recordId": record["id"],
-                                "otherRecordId": value,
-                            }
-                            for value in record["fields"].get(field.name, [])
-                        )
-                    else:  # pragma: no cover
-                        pass
+                    link_fields.append((field.name, self.get_link_table(field, table).name, link_rows))
+                elif child_table_type is not None:
+                    link_fields.append(
+                        (field.name, self.get_link_table(field, table).name, child_table_type.rows(field.options))
+                    )
                 else:
-                    record_to_save[field.db_name(self.prefer_ids)] = record["fields"].get(field.name)
-            records_to_save.append(record_to_save)
+                    columns.append(field.db_name(self.prefer_ids))
+                    fields.append((field.name, field.converter))
+            self.table_plans[table.id] = TablePlan(
+                table_name=table.db_name(self.prefer_ids),
+                columns=tuple(columns),
+                fields=tuple(fields),
+                link_fields=tuple(link_fields),
+                attachment_fields=tuple(attachment_fields),
+                fingerprint=self.table_fingerprints.get(table.id, ""),
+            )
+        return self.table_plans[table.id]
 
-        if isinstance(db_table, sqlite_utils.db.Table):
-            db_table.insert_all(records_to_save)
-        else:  # pragma: no cover
-            pass
+    def transform_record(
+        self, plan: TablePlan, record: Dict[str, Any], links: Dict[str, List[Tuple[Any, ...]]]
+    ) -> Tuple[Any, ...]:
+        # returns the row for the record, and adds the rows for its link
+        # fields to `links`
+        record_id = record["id"]
+        values = record["fields"]
+        for field_name, link_table_name, rows in plan.link_fields:
+            value = values.get(field_name)
+            if value:
+                links[link_table_name].extend(rows(record_id, value))
+        return (
+            record_id,
+            record["createdTime"],
+            record_hash(record, plan.fingerprint),
+            *(convert(values.get(field_name)) for field_name, convert in plan.fields),
+        )
+
+    def flush_records(self, table_name: Optional[str] = None) -> None:
+        table_names = list(self._record_rows.keys()) if table_name is None else [table_name]
+        plans = {plan.table_name: plan for plan in self.table_plans.values()}
+        for name in table_names:
+            rows = self._record_rows.pop(name, [])
+            if not rows:
+                continue
+            upsert = self.incremental or name in self.upsert_tables
+            if upsert:
+                rows = self.remove_unchanged_rows(name, rows)
+                if not rows:
+                    continue
+            self.sink.write_rows(name, plans[name].columns, rows, replace=upsert)
+            self.stats.add_records(name, len(rows))
+            if upsert:
+                # replace the links for any records that have been updated
+                self.delete_link_rows(name, [row[0] for row in rows], flush=True)
+
+    def remove_unchanged_rows(self, table_name: str, rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        # records whose hash is the same as the one stored are left as they
+        # are, along with their link rows, rather than being written again
+        stored_hashes = self.get_stored_hashes(table_name, [row[0] for row in rows])
+        changed = []
+        unchanged: Set[str] = set()
+        for row in rows:
+            if stored_hashes.get(row[0]) == row[2]:
+                unchanged.add(row[0])
+            else:
+                changed.append(row)
+        if unchanged:
+            for link_table_name in self.table_link_tables.get(table_name, []):
+                if link_table_name in self._link_rows:
+                    self._link_rows[link_table_name] = [
+                        row for row in self._link_rows[link_table_name] if row[0] not in unchanged
+                    ]
+            self.stats.add_unchanged(table_name, len(unchanged))
+        return changed
+
+    def get_stored_hashes(self, table_name: str, record_ids: List[str]) -> Dict[str, Optional[str]]:
+        db_table = self._db.table(table_name)
+        if not isinstance(db_table, sqlite_utils.db.Table):  # pragma: no cover
+            return {}
+        stored_hashes = {}
+        for chunk in chunked(record_ids, SQLITE_MAX_PARAMETERS):
+            placeholders = ", ".join("?" for _ in chunk)
+            for row in db_table.rows_where(f"_id in ({placeholders})", chunk, select="_id, _hash"):
+                stored_hashes[row["_id"]] = row["_hash"]
+        return stored_hashes
@@ -1,16 +1,18 @@
+import hashlib
+import json
 import logging
 from copy import copy
-from dataclasses import dataclass
-from typing import Any, Dict, Generator, List, Optional
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Generator, List, Optional, Set, Tuple
 
 from pyairtable.api.base import Base as AirtableBase
 from pyairtable.api.table import Table as AirtableTable
 
 from airtable_to_sqlite.constants import (
-    NUMBER_FIELD_TYPES,
     OPTION_FIELDS,
     PreferedNamingMethod,
 )
+from airtable_to_sqlite.converters import Converter, get_field_type
 
 logger = logging.getLogger(__name__)
 
@@ -35,19 +37,22 @@ class FieldSchema:
         return self.name
 
     @property
-    def column_type(self) -> Any:
-        field_type = self.type
-        if field_type == "formula":
-            if self.options is not None:
-                field_type = self.options.get("result", {}).get("type", field_type)
+    def result_type(self) -> str:
+        # formula and rollup fields are stored according to the type of
+        # value they produce
+        if self.type in ("formula", "rollup") and self.options is not None:
+            return (self.options.get("result") or {}).get("type", self.type)
+        return self.type
 
-        if field_type == "multipleRecordLinks":
+    @property
+    def column_type(self) -> Any:
+        if self.type == "multipleRecordLinks":
             return None
-        if field_type in NUMBER_FIELD_TYPES:
-            return float
-        if field_type in ("checkbox"):
-            return bool
-        return str
+        return get_field_type(self.result_type).column_type
+
+    @property
+    def converter(self) -> Converter:
+        return get_field_type(self.result_type).convert
 
     @property
     def choices(self) -> Optional[List[Dict[str, Any]]]:
@@ -108,9 +113,37 @@ class TableSchema:
             return self.id
         return self.name
 
-    def get_table_data(self, base: AirtableBase) -> Generator[Dict[str, Any], None, None]:
+    def fingerprint(self, *options: str) -> str:
+        # a hash of the table's schema, along with any options that change
+        # how it is stored, used to tell whether it has changed since the
+        # last export
+        content = json.dumps([asdict(self), options], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf8")).hexdigest()
+
+    def iterate_pages(
+        self, base: AirtableBase, offset: Optional[str] = None, **options: Any
+    ) -> Generator[Tuple[List[Dict[str, Any]], Optional[str]], None, None]:
+        # works like pyairtable's Table.iterate(), but also gives the offset
+        # of the next page, so that fetching can be resumed from there
+        # the table ID is used so that renaming a table doesn't break an export
+        table: AirtableTable = base.table(self.id)
+        if offset is not None:
+            options["offset"] = offset
+        for response in table.api.iterate_requests(
+            method="get",
+            url=table.url,
+            fallback=("post", f"{table.url}/listRecords"),
+            options=options,
+        ):
+            yield [dict(record) for record in response.get("records", [])], response.get("offset")
+
+    def get_table_data(self, base: AirtableBase, **options: Any) -> Generator[Dict[str, Any], None, None]:
         logger.info(f"Fetching table data for {self.name} from Airtable...")
-        table: AirtableTable = base.table(self.name)
-        for page in table.iterate():
-            for record in page:
-                yield dict(record)
+        for records, _ in self.iterate_pages(base, **options):
+            yield from records
+
+    def get_record_ids(self, base: AirtableBase, **options: Any) -> Set[str]:
+        # only request the primary field, to keep the response as small as possible
+        logger.info(f"Fetching record IDs for {self.name} from Airtable...")
+        options["fields"] = [self.primaryFieldId]
+        return {record["id"] for records, _ in self.iterate_pages(base, **options) for record in records}
@@ -0,0 +1,193 @@
+import csv
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import IO, Any, Callable, Dict, Optional, Sequence, Set, Tuple
+
+import sqlite_utils
+from sqlite_utils import Database
+
+logger = logging.getLogger(__name__)
+
+Row = Tuple[Any, ...]
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def insert_sql(table_name: str, columns: Sequence[str], *, replace: bool = False) -> str:
+    # identifiers are quoted, and the values are always passed as parameters
+    return "INSERT {}INTO {} ({}) VALUES ({})".format(  # noqa: S608
+        "OR REPLACE " if replace else "",
+        quote_identifier(table_name),
+        ", ".join(quote_identifier(column) for column in columns),
+        ", ".join("?" for _ in columns),
+    )
+
+
+class Sink(ABC):
+    """
+    Where the tables holding the records from Airtable are written.
+
+    Each table is created once, before any rows are written to it. Rows are
+    then written in batches as they are fetched, as tuples holding the value
+    of each column in `columns`. `finalize` is called once the export has
+    finished, or has failed.
+
+    `database` is the SQLite database that the sink writes to, if there is
+    one. Features that need to read back what has been written (incremental
+    updates, resuming, foreign keys and indexes) are only available then.
+    """
+
+    database: Optional[Database] = None
+
+    @abstractmethod
+    def create_table(self, table_name: str, columns: Dict[str, Any], *, pk: Optional[str] = None) -> None:
+        pass
+
+    @abstractmethod
+    def write_rows(
+        self, table_name: str, columns: Sequence[str], rows: Sequence[Row], *, replace: bool = False
+    ) -> None:
+        pass
+
+    def write_link_rows(self, table_name: str, columns: Sequence[str], rows: Sequence[Row]) -> None:
+        self.write_rows(table_name, columns, rows)
+
+    def finalize(self) -> None:
+        pass
+
+
+class SQLiteSink(Sink):
+    def __init__(self, db: Database) -> None:
+        self.db = db
+        self.database = db
+
+    def create_table(self, table_name: str, columns: Dict[str, Any], *, pk: Optional[str] = None) -> None:
+        db_table = self.db.table(table_name)
+        if not isinstance(db_table, sqlite_utils.db.Table):  # pragma: no cover
+            return
+        if db_table.exists():
+            # tables are kept between incremental runs, but fields may have
+            # been added in Airtable since
+            existing_columns = db_table.columns_dict
+            for column, column_type in columns.items():
+                if column not in existing_columns:
+                    db_table.add_column(column, column_type)
+            return
+        db_table.create(columns=columns, pk=pk)
+
+    def write_rows(
+        self, table_name: str, columns: Sequence[str], rows: Sequence[Row], *, replace: bool = False
+    ) -> None:
+        self.db.conn.executemany(insert_sql(table_name, columns, replace=replace), rows)
+
+
+class FileSink(Sink):
+    """
+    Streams each table to its own file in `directory`, keeping one file
+    open for each table. Rows are written as they arrive, so memory use
+    doesn't depend on the size of the base.
+    """
+
+    extension = ""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.files: Dict[str, IO[str]] = {}
+        self.columns: Dict[str, Tuple[str, ...]] = {}
+        # the paths in use, in lower case as file names may not be case
+        # sensitive
+        self.paths: Set[str] = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, table_name: str) -> str:
+        # table names can contain any character, apart from those that
+        # would put the file in a different directory
+        file_name = table_name.replace("/", "_").replace("\\", "_")
+        path = os.path.join(self.directory, file_name + self.extension)
+        # different table names can give the same file name, so a number is
+        # added rather than overwriting the other table's file
+        number = 1
+        while path.lower() in self.paths:
+            number += 1
+            path = os.path.join(self.directory, f"{file_name}_{number}{self.extension}")
+        if number > 1:
+            logger.warning(f"Writing table {table_name} to {os.path.basename(path)}, as its file name is already used")
+        return path
+
+    def create_table(self, table_name: str, columns: Dict[str, Any], *, pk: Optional[str] = None) -> None:  # noqa: ARG002
+        path = self.path(table_name)
+        self.paths.add(path.lower())
+        self.columns[table_name] = tuple(columns)
+        self.files[table_name] = open(path, "w", encoding="utf8", newline="")
+
+    def finalize(self) -> None:
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class NDJSONSink(FileSink):
+    """Writes each table as newline-delimited JSON, with an object for each row."""
+
+    extension = ".ndjson"
+
+    def write_rows(
+        self,
+        table_name: str,
+        columns: Sequence[str],
+        rows: Sequence[Row],
+        *,
+        replace: bool = False,  # noqa: ARG002
+    ) -> None:
+        f = self.files[table_name]
+        for row in rows:
+            f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+            f.write("\n")
+
+
+class CSVSink(FileSink):
+    """
+    Writes each table as CSV, with a header row giving the column names.
+    Values that are lists or objects are already stored as JSON.
+    """
+
+    extension = ".csv"
+
+    def __init__(self, directory: str) -> None:
+        super().__init__(directory)
+        self.writers: Dict[str, Any] = {}
+
+    def create_table(self, table_name: str, columns: Dict[str, Any], *, pk: Optional[str] = None) -> None:
+        super().create_table(table_name, columns, pk=pk)
+        self.writers[table_name] = csv.writer(self.files[table_name])
+        self.writers[table_name].writerow(self.columns[table_name])
+
+    def write_rows(
+        self,
+        table_name: str,
+        columns: Sequence[str],
+        rows: Sequence[Row],
+        *,
+        replace: bool = False,  # noqa: ARG002
+    ) -> None:
+        table_columns = self.columns[table_name]
+        writer = self.writers[table_name]
+        if tuple(columns) == table_columns:
+            writer.writerows(rows)
+            return
+        # put the values in the same order as the header
+        for row in rows:
+            values = dict(zip(columns, row))
+            writer.writerow([values.get(column) for column in table_columns])
+
+
+# the file sinks that can be chosen from the command line, given the directory
+# to write to
+SINKS: Dict[str, Callable[[str], Sink]] = {
+    "ndjson": NDJSONSink,
+    "csv": CSVSink,
+}
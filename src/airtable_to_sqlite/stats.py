@@ -0,0 +1,181 @@
+import contextlib
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+from airtable_to_sqlite.api import RequestMetrics
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # not available on Windows
+    resource = None  # type: ignore[assignment]
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size of this process, in bytes."""
+    if resource is None:  # pragma: no cover
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+@dataclass
+class TableStats:
+    # rows written to the table, and to its link and child tables
+    records: int = 0
+    link_rows: int = 0
+    # records that were fetched again but hadn't changed, so weren't written,
+    # and records removed as they had been deleted from Airtable
+    unchanged: int = 0
+    deleted: int = 0
+    # from starting to fetch the table to writing its last rows
+    seconds: float = 0
+    started: Optional[float] = None
+
+
+class ExportHooks:
+    """
+    Called as an export progresses. Subclass this and override the methods
+    you need, for example to send the timings to a monitoring system.
+    """
+
+    def phase_finished(self, stats: "ExportStats", phase: str, seconds: float) -> None:
+        pass
+
+    def table_finished(self, stats: "ExportStats", table_name: str, table_stats: TableStats) -> None:
+        pass
+
+    def export_finished(self, stats: "ExportStats") -> None:
+        pass
+
+
+class ExportStats:
+    """
+    Timings and counts for the export of a base: the time taken by each
+    phase of the export and by each table, the rows written, the requests
+    made to Airtable for this base and the peak memory use of the process.
+    Rows and tables may be recorded from several threads.
+    """
+
+    def __init__(
+        self,
+        base_id: str,
+        base_name: str,
+        *,
+        request_metrics: Optional[RequestMetrics] = None,
+        hooks: Sequence[ExportHooks] = (),
+    ) -> None:
+        self.base_id = base_id
+        self.base_name = base_name
+        self.request_metrics = request_metrics
+        self.hooks = hooks
+        self.started = datetime.now(timezone.utc)
+        self.seconds: float = 0
+        self.phases: Dict[str, float] = {}
+        self.tables: Dict[str, TableStats] = {}
+        self.attachments: Dict[str, int] = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0) + seconds
+        for hook in self.hooks:
+            hook.phase_finished(self, name, seconds)
+
+    def table(self, table_name: str) -> TableStats:
+        with self._lock:
+            if table_name not in self.tables:
+                self.tables[table_name] = TableStats()
+            return self.tables[table_name]
+
+    def table_started(self, table_name: str) -> None:
+        table_stats = self.table(table_name)
+        with self._lock:
+            if table_stats.started is None:
+                table_stats.started = time.perf_counter()
+
+    def table_finished(self, table_name: str) -> None:
+        table_stats = self.table(table_name)
+        with self._lock:
+            if table_stats.started is not None:
+                table_stats.seconds = time.perf_counter() - table_stats.started
+        for hook in self.hooks:
+            hook.table_finished(self, table_name, table_stats)
+
+    def add_records(self, table_name: str, rows: int) -> None:
+        table_stats = self.table(table_name)
+        with self._lock:
+            table_stats.records += rows
+
+    def add_link_rows(self, table_name: str, rows: int) -> None:
+        table_stats = self.table(table_name)
+        with self._lock:
+            table_stats.link_rows += rows
+
+    def add_unchanged(self, table_name: str, rows: int) -> None:
+        table_stats = self.table(table_name)
+        with self._lock:
+            table_stats.unchanged += rows
+
+    def add_deleted(self, table_name: str, rows: int) -> None:
+        table_stats = self.table(table_name)
+        with self._lock:
+            table_stats.deleted += rows
+
+    def finish(self) -> None:
+        self.seconds = time.perf_counter() - self._start
+        for hook in self.hooks:
+            hook.export_finished(self)
+
+    @property
+    def records(self) -> int:
+        return sum(table_stats.records for table_stats in self.tables.values())
+
+    @property
+    def link_rows(self) -> int:
+        return sum(table_stats.link_rows for table_stats in self.tables.values())
+
+    @property
+    def unchanged(self) -> int:
+        return sum(table_stats.unchanged for table_stats in self.tables.values())
+
+    @property
+    def deleted(self) -> int:
+        return sum(table_stats.deleted for table_stats in self.tables.values())
+
+    @property
+    def requests(self) -> Dict[str, Any]:
+        if self.request_metrics is None:
+            return {}
+        return self.request_metrics.as_dict(self.base_id)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "base": {"id": self.base_id, "name": self.base_name},
+            "started": self.started.isoformat(),
+            "seconds": self.seconds,
+            "records": self.records,
+            "link_rows": self.link_rows,
+            "unchanged": self.unchanged,
+            "deleted": self.deleted,
+            "records_per_second": self.records / self.seconds if self.seconds else None,
+            "phases": dict(self.phases),
+            "tables": {
+                table_name: {key: value for key, value in asdict(table_stats).items() if key != "started"}
+                for table_name, table_stats in self.tables.items()
+            },
+            "requests": self.requests,
+            "attachments": dict(self.attachments),
+            "peak_rss": peak_rss(),
+        }
@@ -3,23 +3,35 @@ from unittest.mock import Mock
 import pytest
 from pyairtable.api.api import Api as AirtableApi
 from pyairtable.api.base import Base as AirtableBase
+from requests import Session
 
-from .dummy_returns import BASE_SCHEMA, DUMMY_RECORDS, GET_API_BASES
+from .dummy_returns import BASE_SCHEMA, DUMMY_RESPONSES, GET_API_BASES
+
+
+def iterate_requests(method, url, fallback=None, options=None):  # noqa: ARG001
+    # start from the page after the offset given, if there is one
+    offset = (options or {}).get("offset")
+    responses = DUMMY_RESPONSES
+    for index, response in enumerate(DUMMY_RESPONSES):
+        if offset is not None and response.get("offset") == offset:
+            responses = DUMMY_RESPONSES[index + 1 :]
+    return iter(responses)
 
 
 @pytest.fixture(name="_mock_api")
 def mock_api(mocker):
     mock = Mock(spec=AirtableApi)
-    mock.base.return_value.table.return_value.iterate.return_value = DUMMY_RECORDS
+    mock.session = Mock(spec=Session)
+    mock.base.return_value.table.return_value.api.iterate_requests.side_effect = iterate_requests
 
-    mocker.patch("airtable_to_sqlite.main.AirtableApi", return_value=mock)
+    mocker.patch("airtable_to_sqlite.api.AirtableApi", return_value=mock)
     return mock
 
 
 @pytest.fixture(name="_mock_base")
 def mock_base(mocker):
     mock = Mock(spec=AirtableBase)
-    mock.table.return_value.iterate.return_value = DUMMY_RECORDS
+    mock.table.return_value.api.iterate_requests.side_effect = iterate_requests
 
     mocker.patch("airtable_to_sqlite.schema.AirtableBase", return_value=mock)
     return mock
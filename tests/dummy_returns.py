@@ -59,6 +59,7 @@ DUMMY_RECORDS = [
                 "Name": "Test 4",
                 "Number": 124,
                 "Checkbox": True,
+                "Linked record": ["rec901", "rec902"],
             },
         },
     ],
@@ -70,6 +71,7 @@ DUMMY_RECORDS = [
                 "Name": "Test 5",
                 "Number": 125,
                 "Checkbox": True,
+                "Linked record": ["rec901"],
             },
         },
         {
@@ -83,6 +85,10 @@ DUMMY_RECORDS = [
         },
     ],
 ]
+DUMMY_RESPONSES = [
+    {"records": DUMMY_RECORDS[0], "offset": "itr123/rec124"},
+    {"records": DUMMY_RECORDS[1]},
+]
 GET_API_BASES = {
     "bases": [
         {"id": "app123", "name": "Base 123", "permissionLevel": "create"},
@@ -0,0 +1,174 @@
+import io
+import time
+from unittest.mock import Mock
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from airtable_to_sqlite.api import (
+    RateLimitedAdapter,
+    RateLimiter,
+    RequestMetrics,
+    RetryPolicy,
+    TokenBucket,
+    get_api,
+    get_base_id,
+    get_request_metrics,
+    get_retry_after,
+)
+from airtable_to_sqlite.constants import AirtablePersonalAccessToken
+
+
+def make_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.raw = io.BytesIO(b"")
+    return response
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=50)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # first token is available immediately, the next five take 1/50th second each
+    assert time.monotonic() - start >= 0.09
+
+
+def test_token_bucket_backoff():
+    bucket = TokenBucket(rate=1000)
+    bucket.backoff(0.1)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_rate_limiter_bucket_per_base():
+    limiter = RateLimiter()
+    bucket = limiter.bucket_for("https://api.airtable.com/v0/app123/tbl123")
+    assert limiter.bucket_for("https://api.airtable.com/v0/app123/tbl456?offset=abc") is bucket
+    assert limiter.bucket_for("https://api.airtable.com/v0/meta/bases/app123/tables") is bucket
+    assert limiter.bucket_for("https://api.airtable.com/v0/app456/tbl123") is not bucket
+    assert limiter.bucket_for("https://api.airtable.com/v0/meta/bases") is not bucket
+    assert bucket.rate == 5
+
+
+def test_get_retry_after():
+    assert get_retry_after(make_response(429, {"Retry-After": "2"}), 30) == 2
+    assert get_retry_after(make_response(429, {"Retry-After": "soon"}), 30) == 30
+    assert get_retry_after(make_response(429), 30) == 30
+
+
+def test_rate_limited_adapter_retries(mocker):
+    send = mocker.patch.object(
+        HTTPAdapter,
+        "send",
+        side_effect=[make_response(429, {"Retry-After": "0"}), make_response(429), make_response(200)],
+    )
+    adapter = RateLimitedAdapter(RateLimiter(rate=1000), RetryPolicy(rate_limit_backoff=0.01))
+    request = requests.Request("GET", "https://api.airtable.com/v0/app123/tbl123").prepare()
+    assert adapter.send(request).status_code == 200
+    assert send.call_count == 3
+
+
+def test_rate_limited_adapter_gives_up(mocker):
+    send = mocker.patch.object(
+        HTTPAdapter, "send", side_effect=[make_response(429, {"Retry-After": "0"}) for _ in range(3)]
+    )
+    adapter = RateLimitedAdapter(RateLimiter(rate=1000), RetryPolicy(max_attempts=3))
+    request = requests.Request("GET", "https://api.airtable.com/v0/app123/tbl123").prepare()
+    assert adapter.send(request).status_code == 429
+    assert send.call_count == 3
+
+
+def test_retry_policy_should_retry():
+    policy = RetryPolicy(max_attempts=3)
+    assert policy.should_retry(1)
+    assert policy.should_retry(2, make_response(503))
+    assert policy.should_retry(1, make_response(429))
+    assert not policy.should_retry(1, make_response(200))
+    assert not policy.should_retry(1, make_response(404))
+    assert not policy.should_retry(3, make_response(503))
+
+
+def test_retry_policy_delay():
+    policy = RetryPolicy(base_delay=1, max_delay=5, jitter=0.5, rate_limit_backoff=30)
+    assert 1 <= policy.delay(1) <= 1.5
+    assert 4 <= policy.delay(3) <= 6
+    assert 5 <= policy.delay(10) <= 7.5
+    assert 30 <= policy.delay(1, make_response(429)) <= 45
+    assert 2 <= policy.delay(1, make_response(429, {"Retry-After": "2"})) <= 3
+    assert 7 <= policy.delay(1, make_response(503, {"Retry-After": "7"})) <= 10.5
+    assert RetryPolicy(base_delay=1, jitter=0).delay(2) == 2
+
+
+def test_rate_limited_adapter_retries_errors(mocker):
+    send = mocker.patch.object(
+        HTTPAdapter,
+        "send",
+        side_effect=[requests.ConnectionError("reset"), make_response(502), make_response(200)],
+    )
+    metrics = RequestMetrics()
+    adapter = RateLimitedAdapter(RateLimiter(rate=1000), RetryPolicy(base_delay=0.01), metrics=metrics)
+    request = requests.Request("GET", "https://api.airtable.com/v0/app123/tbl123").prepare()
+    assert adapter.send(request).status_code == 200
+    assert send.call_count == 3
+    assert metrics.as_dict() == {"requests": 3, "bytes": 0, "retries": {"ConnectionError": 1, "502": 1}}
+
+
+def test_request_metrics_by_base():
+    metrics = RequestMetrics()
+    metrics.record_request("app123")
+    metrics.record_request("app123")
+    metrics.record_request("app456")
+    metrics.record_response(make_response(200, {"Content-Length": "150"}), "app123")
+    metrics.record_retry("429", "app456")
+    assert metrics.as_dict("app123") == {"requests": 2, "bytes": 150, "retries": {}}
+    assert metrics.as_dict("app456") == {"requests": 1, "bytes": 0, "retries": {"429": 1}}
+    assert metrics.as_dict() == {"requests": 3, "bytes": 150, "retries": {"429": 1}}
+    assert get_base_id("https://api.airtable.com/v0/meta/bases/app123/tables") == "app123"
+
+
+def test_get_request_metrics():
+    metrics = RequestMetrics()
+    assert get_request_metrics(get_api(AirtablePersonalAccessToken("key123"), metrics=metrics)) is metrics
+
+
+def test_rate_limited_adapter_raises_connection_error(mocker):
+    send = mocker.patch.object(HTTPAdapter, "send", side_effect=requests.ConnectionError("reset"))
+    adapter = RateLimitedAdapter(RateLimiter(rate=1000), RetryPolicy(max_attempts=2, base_delay=0.01))
+    request = requests.Request("GET", "https://api.airtable.com/v0/app123/tbl123").prepare()
+    with pytest.raises(requests.ConnectionError):
+        adapter.send(request)
+    assert send.call_count == 2
+
+
+def test_get_api():
+    limiter = RateLimiter()
+    api = get_api(AirtablePersonalAccessToken("key123"), rate_limiter=limiter)
+    adapter = api.session.get_adapter("https://api.airtable.com/v0/app123")
+    assert isinstance(adapter, RateLimitedAdapter)
+    assert adapter.rate_limiter is limiter
+
+
+@pytest.mark.parametrize("url", ["https://api.airtable.com/v0/app123/tbl123", "http://localhost/v0/app123"])
+def test_get_api_default_limiter(url):
+    api = get_api(AirtablePersonalAccessToken("key123"))
+    assert isinstance(api.session.get_adapter(url), RateLimitedAdapter)
+    assert not isinstance(api.session, Mock)
+    assert api.session.get_adapter(url).max_retries.total == 0
+
+
+def test_get_api_pool_and_timeout():
+    api = get_api(AirtablePersonalAccessToken("key123"), pool_size=25, timeout=5)
+    adapter = api.session.get_adapter("https://api.airtable.com/v0/app123")
+    assert adapter._pool_maxsize == 25
+    assert api.timeout == (5, 5)
+    assert get_api(AirtablePersonalAccessToken("key123"), timeout=None).timeout is None
+
+
+def test_get_api_endpoint_url():
+    api = get_api(AirtablePersonalAccessToken("key123"), endpoint_url="http://127.0.0.1:8000")
+    assert api.build_url("meta", "bases") == "http://127.0.0.1:8000/v0/meta/bases"
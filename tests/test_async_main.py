@@ -0,0 +1,92 @@
+import os
+import tempfile
+
+import pytest
+from sqlite_utils import Database
+
+from airtable_to_sqlite.async_main import AsyncAirtableBaseToSqlite
+from airtable_to_sqlite.constants import AirtablePersonalAccessToken, PreferedNamingMethod
+from airtable_to_sqlite.main import AirtableBaseToSqlite, export_base
+from airtable_to_sqlite.schema import BaseRecord
+
+
+def export_contents(exporter, **kwargs):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    exporter(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        **kwargs,
+    ).run()
+    return {table_name: sorted(tuple(row.values()) for row in db[table_name].rows) for table_name in db.table_names()}
+
+
+@pytest.mark.parametrize(("concurrency", "queue_size", "batch_size"), [(1, 1, 1), (2, 10, 1000), (4, 2, 3)])
+def test_async_airtable_base_to_sqlite_matches(_mock_base_schema, _mock_api, concurrency, queue_size, batch_size):
+    expected = export_contents(AirtableBaseToSqlite)
+    result = export_contents(
+        AsyncAirtableBaseToSqlite, concurrency=concurrency, queue_size=queue_size, batch_size=batch_size
+    )
+    assert result == expected
+    assert len(result["tbl124"]) == 4
+    assert len(result["tbl123_fld123456789D"]) == 3
+
+
+def test_async_airtable_base_to_sqlite_progress_names_base(_mock_base_schema, _mock_api, capsys):
+    export_contents(AsyncAirtableBaseToSqlite)
+    assert "My Base: 8 records" in capsys.readouterr().err
+
+
+def test_async_airtable_base_to_sqlite_incremental(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    for _ in range(2):
+        AsyncAirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            incremental=True,
+        ).run()
+    assert db["My Table"].count == 4
+    settings = {row["key"]: row["value"] for row in db["_meta_settings"].rows}
+    assert "last_synced:tbl123" in settings
+
+
+def test_async_airtable_base_to_sqlite_error(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AsyncAirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        concurrency=2,
+    )
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = ConnectionError("Network down")
+    with pytest.raises(ConnectionError):
+        api.run()
+
+
+def test_async_airtable_base_to_sqlite_write_error(mocker, _mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AsyncAirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        queue_size=1,
+    )
+    mocker.patch.object(api, "add_page_rows", side_effect=ValueError("Disk full"))
+    with pytest.raises(ValueError, match="Disk full"):
+        api.run()
+
+
+def test_export_base_async(_mock_base_schema, _mock_api):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        export_base(AirtablePersonalAccessToken("key123"), base, database, use_async=True, concurrency=2)
+        db = Database(database)
+        assert db["My Other Table"].count == 4
+        db.close()
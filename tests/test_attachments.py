@@ -0,0 +1,124 @@
+import copy
+import hashlib
+import io
+import os
+import tempfile
+
+import requests
+from sqlite_utils import Database
+
+from airtable_to_sqlite.attachments import AttachmentDownloader
+from airtable_to_sqlite.constants import AirtablePersonalAccessToken
+from airtable_to_sqlite.main import AirtableBaseToSqlite
+from airtable_to_sqlite.schema import BaseRecord
+
+from .dummy_returns import BASE_SCHEMA
+
+FILES = {
+    "https://example.com/a.png": b"file a",
+    "https://example.com/a-again.png": b"file a",
+    "https://example.com/b.png": b"file b",
+}
+
+
+def fake_get(url, **kwargs):  # noqa: ARG001
+    response = requests.Response()
+    response.url = url
+    if url in FILES:
+        response.status_code = 200
+        response.raw = io.BytesIO(FILES[url])
+    else:
+        response.status_code = 404
+        response.raw = io.BytesIO(b"")
+    return response
+
+
+def attachment(attachment_id, url):
+    return {"id": attachment_id, "url": url, "filename": url.rsplit("/", 1)[-1], "type": "image/png"}
+
+
+def test_attachment_downloader_database(mocker):
+    db = Database(memory=True)
+    downloader = AttachmentDownloader(db, workers=2)
+    get = mocker.patch.object(downloader.session, "get", side_effect=fake_get)
+    downloader.create_tables()
+    downloader.submit("rec1", "fld1", attachment("att1", "https://example.com/a.png"))
+    downloader.submit("rec2", "fld1", attachment("att2", "https://example.com/a-again.png"))
+    downloader.submit("rec2", "fld1", attachment("att3", "https://example.com/b.png"))
+    downloader.submit("rec3", "fld1", attachment("att4", "https://example.com/expired.png"))
+    downloader.finish()
+    # already stored, so not downloaded again
+    downloader.submit("rec1", "fld1", attachment("att1", "https://example.com/a.png"))
+    downloader.close()
+
+    assert get.call_count == 4
+    assert dict(downloader.counts) == {"downloaded": 3, "bytes": 18, "failed": 1, "skipped": 1}
+    rows = {row["id"]: row for row in db["_attachment"].rows}
+    assert set(rows) == {"att1", "att2", "att3"}
+    assert rows["att1"]["hash"] == hashlib.sha256(b"file a").hexdigest()
+    assert rows["att1"]["hash"] == rows["att2"]["hash"]
+    assert rows["att3"]["recordId"] == "rec2"
+    assert rows["att1"]["size"] == 6
+    assert db["_attachment_content"].count == 2
+    assert db["_attachment_content"].get(rows["att3"]["hash"])["content"] == b"file b"
+
+
+def test_attachment_downloader_directory(mocker):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        db = Database(memory=True)
+        downloader = AttachmentDownloader(db, tmpdirname)
+        mocker.patch.object(downloader.session, "get", side_effect=fake_get)
+        downloader.create_tables()
+        downloader.submit("rec1", "fld1", attachment("att1", "https://example.com/a.png"))
+        downloader.submit("rec2", "fld1", attachment("att2", "https://example.com/a-again.png"))
+        downloader.finish()
+        downloader.close()
+
+        content_hash = hashlib.sha256(b"file a").hexdigest()
+        path = os.path.join(content_hash[:2], content_hash)
+        with open(os.path.join(tmpdirname, path), "rb") as f:
+            assert f.read() == b"file a"
+        assert db["_attachment"].get("att1")["path"] == path
+        assert "_attachment_content" not in db.table_names()
+        assert not [name for name in os.listdir(tmpdirname) if name.endswith(".tmp")]
+
+        # a new export to the same directory reuses the files already there
+        db = Database(memory=True)
+        downloader = AttachmentDownloader(db, tmpdirname)
+        get = mocker.patch.object(downloader.session, "get", side_effect=fake_get)
+        downloader.create_tables()
+        downloader.submit("rec1", "fld1", attachment("att1", "https://example.com/a.png"))
+        downloader.finish()
+        downloader.close()
+        get.assert_not_called()
+        assert db["_attachment"].get("att1")["hash"] == content_hash
+
+
+def test_airtable_base_to_sqlite_download_attachments(mocker, _mock_api):
+    mocker.patch.object(requests.Session, "get", side_effect=fake_get)
+    schema = copy.deepcopy(BASE_SCHEMA)
+    schema["tables"][0]["fields"].append({"type": "multipleAttachments", "id": "fld123456789F", "name": "Files"})
+    mocker.patch("pyairtable.metadata.get_base_schema", return_value=schema)
+    record = {
+        "id": "rec123",
+        "createdTime": "2021-01-01T00:00:00.000Z",
+        "fields": {
+            "Name": "Test",
+            "Files": [attachment("att1", "https://example.com/a.png"), attachment("att2", "https://example.com/b.png")],
+        },
+    }
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.return_value = [{"records": [record]}]
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = None
+    db = Database(memory=True)
+    stats = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=BaseRecord(id="app123", name="My Base", permissionLevel="create"),
+        download_attachments=True,
+    ).run()
+
+    assert {row["id"] for row in db["_attachment"].rows} == {"att1", "att2"}
+    assert db["_attachment"].get("att1")["fieldId"] == "fld123456789F"
+    assert db["_attachment_content"].count == 2
+    assert stats.attachments["downloaded"] == 2
+    assert "download_attachments" in stats.phases
@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+
+import requests
+from sqlite_utils import Database
+
+from benchmarks.fake_airtable import BaseSpec, FakeAirtableServer, FakeBase, record_id
+from benchmarks.import_time import CLI_MODULE, format_results, import_times, loaded_heavy_modules, time_command
+from benchmarks.run import run_benchmark
+
+
+def test_fake_base_is_repeatable():
+    spec = BaseSpec(tables=2, records=250, link_density=2)
+    base = FakeBase(spec)
+    page = base.page(0, None)
+    assert len(page["records"]) == 100
+    assert page["records"] == FakeBase(spec).page(0, None)["records"]
+    assert base.page(0, page["offset"])["records"][0]["id"] == record_id(0, 100)
+    assert "offset" not in base.page(0, "itr/200")
+    links = page["records"][0]["fields"]["multipleRecordLinks 1"]
+    assert len(links) == 2
+    assert all(link.startswith("rec0001") for link in links)
+
+
+def test_fake_server_rate_limit():
+    base = FakeBase(BaseSpec(tables=1, records=10))
+    with FakeAirtableServer([base], rate_limit=2, retry_after=0) as server:
+        url = f"{server.url}/v0/{base.id}/{base.tables[0]['id']}"
+        statuses = [requests.get(url, timeout=5).status_code for _ in range(3)]
+        response = requests.get(f"{server.url}/v0/meta/bases", timeout=5)
+    assert statuses == [200, 200, 429]
+    assert response.json()["bases"][0]["id"] == base.id
+    assert server.rate_limited == 1
+
+
+def test_run_benchmark():
+    spec = BaseSpec(tables=2, records=150)
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "benchmark.db")
+        results = run_benchmark(spec, database, client_rate=1000, rate_limit=5, retry_after=0.5)
+        db = Database(database)
+        assert db["Table 1"].count == 150
+        assert db["Table 2"].count == 150
+        db.close()
+    assert results["records"] == 300
+    assert results["records_per_second"] > 0
+    assert results["peak_rss"] > 0
+    assert {"get_schema", "insert_all_table_data", "create_indexes"} <= set(results["phases"])
+    assert set(results["tables"]) == {"Table 1", "Table 2"}
+
+
+def test_import_time():
+    times = dict(import_times())
+    assert times[CLI_MODULE] > 0
+    assert "click" in times
+    assert time_command([sys.executable, "-c", "pass"], repeat=1) > 0
+    results = {"commands": {"import": 0.1}, "imports": times, "heavy_modules": []}
+    assert "Heavy modules imported: none" in format_results(results)
+
+
+def test_cli_imports_no_heavy_modules():
+    # pyairtable, sqlite-utils and the rest are only imported once an export
+    # starts, so that --help and --version are quick
+    assert loaded_heavy_modules() == []
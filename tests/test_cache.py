@@ -0,0 +1,87 @@
+import io
+import tempfile
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from airtable_to_sqlite.api import RateLimitedAdapter, RateLimiter
+from airtable_to_sqlite.cache import ResponseCache
+
+
+def make_request(method="GET", url="https://api.airtable.com/v0/app123/tbl123", token="key123", json=None):
+    return requests.Request(method, url, headers={"Authorization": f"Bearer {token}"}, json=json).prepare()
+
+
+def make_response(status_code=200, content=b'{"records": []}'):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers["Content-Type"] = "application/json"
+    response._content = content
+    response.raw = io.BytesIO(b"")
+    return response
+
+
+@pytest.fixture(name="cache")
+def response_cache():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        cache = ResponseCache(tmpdirname)
+        yield cache
+        cache.close()
+
+
+def test_response_cache_roundtrip(cache):
+    request = make_request()
+    assert cache.lookup(request) is None
+    cache.store(request, make_response())
+
+    response = cache.lookup(make_request())
+    assert response is not None
+    assert response.status_code == 200
+    assert response.json() == {"records": []}
+    assert response.headers["content-type"] == "application/json"
+    assert response.url == request.url
+
+
+def test_response_cache_key(cache):
+    cache.store(make_request(), make_response())
+    assert cache.lookup(make_request(token="key456")) is None
+    assert cache.lookup(make_request(url="https://api.airtable.com/v0/app123/tbl123?offset=abc")) is None
+
+
+def test_response_cache_not_cacheable(cache):
+    cache.store(make_request(), make_response(status_code=500))
+    assert cache.lookup(make_request()) is None
+
+    request = make_request(method="PATCH", json={"records": []})
+    cache.store(request, make_response())
+    assert cache.lookup(request) is None
+
+
+def test_response_cache_list_records(cache):
+    url = "https://api.airtable.com/v0/app123/tbl123/listRecords"
+    cache.store(make_request(method="POST", url=url, json={"offset": "abc"}), make_response())
+    assert cache.lookup(make_request(method="POST", url=url, json={"offset": "abc"})) is not None
+    assert cache.lookup(make_request(method="POST", url=url, json={"offset": "def"})) is None
+
+
+def test_response_cache_ttl():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        cache = ResponseCache(tmpdirname, ttl=-1)
+        cache.store(make_request(), make_response())
+        assert cache.lookup(make_request()) is None
+        cache.close()
+
+
+def test_response_cache_clear(cache):
+    cache.store(make_request(), make_response())
+    cache.clear()
+    assert cache.lookup(make_request()) is None
+
+
+def test_rate_limited_adapter_cache(mocker, cache):
+    send = mocker.patch.object(HTTPAdapter, "send", return_value=make_response())
+    adapter = RateLimitedAdapter(RateLimiter(rate=1000), cache=cache)
+    assert adapter.send(make_request()).json() == {"records": []}
+    assert adapter.send(make_request()).json() == {"records": []}
+    assert send.call_count == 1
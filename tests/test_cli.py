@@ -1,11 +1,17 @@
+import json
 import os
+import sys
 import tempfile
 
+import pytest
 from click.testing import CliRunner
+from sqlite_utils import Database
 
 import airtable_to_sqlite.__main__ as armain
 from airtable_to_sqlite.cli import airtable_to_sqlite
 
+from .dummy_returns import BASE_SCHEMA
+
 _ = armain
 
 
@@ -33,3 +39,254 @@ def test_cli_filename(_mock_api, _mock_get_api_bases, _mock_base_schema):
         result = runner.invoke(airtable_to_sqlite, ["--output", os.path.join(tmpdirname, "blah.db"), "app123"])
         assert result.exit_code == 0
         assert os.path.exists(os.path.join(tmpdirname, "blah.db"))
+
+
+def test_cli_jobs(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(
+            airtable_to_sqlite, ["--jobs", "2", "--output", os.path.join(tmpdirname, "{}.db"), "app123", "app124"]
+        )
+        assert result.exit_code == 0
+        assert os.path.exists(os.path.join(tmpdirname, "Base 123.db"))
+        assert os.path.exists(os.path.join(tmpdirname, "Base 124.db"))
+
+
+def test_cli_jobs_failure(mocker, _mock_api, _mock_get_api_bases):
+    mocker.patch("pyairtable.metadata.get_base_schema", side_effect=[BASE_SCHEMA, ConnectionError("Network down")])
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(
+            airtable_to_sqlite, ["--jobs", "2", "--output", os.path.join(tmpdirname, "{}.db"), "app123", "app124"]
+        )
+        assert result.exit_code == 1
+        assert "Failed to export 1 of 2 bases" in result.output
+
+
+def test_cli_duplicate_filename(mocker, _mock_api, _mock_base_schema):
+    mocker.patch(
+        "pyairtable.metadata.get_api_bases",
+        return_value={
+            "bases": [
+                {"id": "app123", "name": "Base", "permissionLevel": "create"},
+                {"id": "app124", "name": "Base", "permissionLevel": "create"},
+            ]
+        },
+    )
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(airtable_to_sqlite, ["--output", os.path.join(tmpdirname, "{}.db"), "app123", "app124"])
+        assert result.exit_code == 2
+        assert "More than one base would be saved to the same file" in result.output
+
+
+def test_cli_incremental(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        for _ in range(2):
+            result = runner.invoke(
+                airtable_to_sqlite, ["--incremental", "--output", os.path.join(tmpdirname, "{}.db"), "app123"]
+            )
+            assert result.exit_code == 0
+        db = Database(os.path.join(tmpdirname, "Base 123.db"))
+        assert db["My Table"].count == 4
+        assert db["_meta_settings"].get("last_synced:tbl123")
+        db.close()
+
+
+def test_cli_cache_dir(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        cache_dir = os.path.join(tmpdirname, "cache")
+        result = runner.invoke(
+            airtable_to_sqlite,
+            ["--cache-dir", cache_dir, "--output", os.path.join(tmpdirname, "{}.db"), "app123"],
+        )
+        assert result.exit_code == 0
+        assert os.path.isdir(cache_dir)
+
+
+def test_cli_resume(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(
+            airtable_to_sqlite, ["--resume", "--output", os.path.join(tmpdirname, "{}.db"), "app123"]
+        )
+        assert result.exit_code == 0
+        db = Database(os.path.join(tmpdirname, "Base 123.db"))
+        assert db["My Table"].count == 4
+        assert "_meta_checkpoint" not in db.table_names()
+        db.close()
+
+
+def test_cli_bulk_load(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(
+            airtable_to_sqlite, ["--bulk-load", "--output", os.path.join(tmpdirname, "{}.db"), "app123"]
+        )
+        assert result.exit_code == 0
+        db = Database(os.path.join(tmpdirname, "Base 123.db"))
+        assert db["My Table"].count == 4
+        db.close()
+
+
+def test_cli_index(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(
+            airtable_to_sqlite,
+            ["--index", "My Table", "Name", "--output", os.path.join(tmpdirname, "{}.db"), "app123"],
+        )
+        assert result.exit_code == 0
+        db = Database(os.path.join(tmpdirname, "Base 123.db"))
+        assert ["Name"] in [index.columns for index in db["My Table"].indexes]
+        db.close()
+
+
+def test_cli_child_tables(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(
+            airtable_to_sqlite, ["--child-tables", "--output", os.path.join(tmpdirname, "{}.db"), "app123"]
+        )
+        assert result.exit_code == 0
+        db = Database(os.path.join(tmpdirname, "Base 123.db"))
+        assert db["My Table"].count == 4
+        db.close()
+
+
+def test_cli_partial_export(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(
+            airtable_to_sqlite,
+            [
+                "--table",
+                "My Table",
+                "--field",
+                "My Table",
+                "Name",
+                "--view",
+                "My Table",
+                "Grid view",
+                "--output",
+                os.path.join(tmpdirname, "{}.db"),
+                "app123",
+            ],
+        )
+        assert result.exit_code == 0
+        db = Database(os.path.join(tmpdirname, "Base 123.db"))
+        assert "My Other Table" not in db.table_names()
+        assert [c.name for c in db["My Table"].columns] == ["_id", "_createdTime", "_hash", "Name"]
+        db.close()
+
+
+def test_cli_shared_api(mocker, _mock_api, _mock_get_api_bases, _mock_base_schema):
+    get_api = mocker.patch("airtable_to_sqlite.api.get_api", return_value=_mock_api)
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(
+            airtable_to_sqlite,
+            [
+                "--pool-size",
+                "4",
+                "--timeout",
+                "5",
+                "--max-attempts",
+                "3",
+                "--jobs",
+                "2",
+                "--output",
+                os.path.join(tmpdirname, "{}.db"),
+                "app123",
+                "app124",
+            ],
+        )
+        assert result.exit_code == 0
+    # a single client is shared by every base
+    get_api.assert_called_once()
+    assert get_api.call_args.kwargs["pool_size"] == 4
+    assert get_api.call_args.kwargs["timeout"] == 5
+    assert get_api.call_args.kwargs["retry_policy"].max_attempts == 3
+
+
+def test_cli_async(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = runner.invoke(
+            airtable_to_sqlite,
+            ["--async", "--concurrency", "2", "--output", os.path.join(tmpdirname, "{}.db"), "app123"],
+        )
+        assert result.exit_code == 0
+        db = Database(os.path.join(tmpdirname, "Base 123.db"))
+        assert db["My Table"].count == 4
+        db.close()
+
+
+def test_cli_stats_file(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        stats_file = os.path.join(tmpdirname, "stats.json")
+        result = runner.invoke(
+            airtable_to_sqlite,
+            ["--stats-file", stats_file, "--output", os.path.join(tmpdirname, "{}.db"), "app123"],
+        )
+        assert result.exit_code == 0
+        with open(stats_file, encoding="utf8") as f:
+            stats = json.load(f)
+    assert stats["failed"] == []
+    assert stats["bases"][0]["base"] == {"id": "app123", "name": "Base 123"}
+    assert stats["bases"][0]["records"] == 8
+    assert stats["bases"][0]["tables"]["My Table"]["link_rows"] == 3
+    assert "insert_all_table_data" in stats["bases"][0]["phases"]
+
+
+def test_cli_download_attachments(mocker, _mock_api, _mock_get_api_bases, _mock_base_schema):
+    export_base = mocker.patch("airtable_to_sqlite.main.export_base")
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        attachments_dir = os.path.join(tmpdirname, "files")
+        result = runner.invoke(
+            airtable_to_sqlite,
+            [
+                "--attachments-dir",
+                attachments_dir,
+                "--attachment-workers",
+                "8",
+                "--output",
+                os.path.join(tmpdirname, "{}.db"),
+                "app123",
+            ],
+        )
+        assert result.exit_code == 0
+    assert export_base.call_args.kwargs["download_attachments"] is True
+    assert export_base.call_args.kwargs["attachments_dir"] == attachments_dir
+    assert export_base.call_args.kwargs["attachment_workers"] == 8
+
+
+def test_cli_format(monkeypatch, _mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        monkeypatch.chdir(tmpdirname)
+        # the default output is a directory named after the base
+        result = runner.invoke(airtable_to_sqlite, ["--format", "ndjson", "app123"])
+        assert result.exit_code == 0
+        assert os.path.exists(os.path.join(tmpdirname, "Base 123", "My Table.ndjson"))
+        monkeypatch.undo()
+
+
+def test_cli_format_sqlite_options(_mock_api, _mock_get_api_bases, _mock_base_schema):
+    runner = CliRunner()
+    result = runner.invoke(airtable_to_sqlite, ["--format", "csv", "--incremental", "app123"])
+    assert result.exit_code == 2
+    assert "--incremental can only be used with --format sqlite" in result.output
+
+
+def test_main_version(mocker, monkeypatch):
+    load_dotenv = mocker.patch("dotenv.load_dotenv")
+    monkeypatch.setattr(sys, "argv", ["airtable-to-sqlite", "--version"])
+    with pytest.raises(SystemExit) as exit_info:
+        armain.main()
+    assert exit_info.value.code == 0
+    load_dotenv.assert_not_called()
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from airtable_to_sqlite.converters import (
+    DEFAULT_FIELD_TYPE,
+    FIELD_TYPES,
+    FieldType,
+    get_field_type,
+    record_hash,
+    register_field_type,
+    to_json,
+    to_scalar,
+)
+
+
+def test_to_scalar():
+    assert to_scalar(None) is None
+    assert to_scalar("text") == "text"
+    assert to_scalar(1.5) == 1.5
+    assert to_scalar(["a", "b"]) == '["a", "b"]'
+    assert to_scalar({"specialValue": "NaN"}) == '{"specialValue": "NaN"}'
+
+
+def test_to_json():
+    assert to_json(None) is None
+    assert to_json("text") == '"text"'
+    assert json.loads(to_json(["é", "b"])) == ["é", "b"]
+    assert to_json(["é"]) == '["é"]'
+
+
+@pytest.mark.parametrize(
+    ("field_type", "column_type"),
+    [
+        ("number", float),
+        ("autoNumber", int),
+        ("checkbox", bool),
+        ("multipleSelects", list),
+        ("multipleAttachments", list),
+        ("singleCollaborator", dict),
+        ("singleLineText", str),
+        ("somethingNew", str),
+    ],
+)
+def test_get_field_type(field_type, column_type):
+    assert get_field_type(field_type).column_type is column_type
+
+
+def test_register_field_type():
+    try:
+        register_field_type("somethingNew", int, int)
+        assert get_field_type("somethingNew") == FieldType(int, int)
+    finally:
+        FIELD_TYPES.pop("somethingNew")
+    assert get_field_type("somethingNew") == DEFAULT_FIELD_TYPE
+
+
+def test_record_hash():
+    record = {
+        "id": "rec123",
+        "createdTime": "2021-01-01T00:00:00.000Z",
+        "fields": {
+            "Name": "Test",
+            "Attachments": [{"id": "att123", "url": "https://example.com/1", "thumbnails": {"small": {}}}],
+        },
+    }
+    same = {
+        "id": "rec123",
+        "createdTime": "2021-01-01T00:00:00.000Z",
+        "fields": {"Attachments": [{"id": "att123", "url": "https://example.com/2"}], "Name": "Test"},
+    }
+    changed = {**record, "fields": {**record["fields"], "Name": "Changed"}}
+    assert record_hash(record) == record_hash(same)
+    assert record_hash(record) != record_hash(changed)
+    assert record_hash(record) != record_hash(record, "salt")
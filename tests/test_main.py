@@ -1,4 +1,10 @@
+import copy
+import json
+import os
+import tempfile
+
 import pytest
+import requests
 from sqlite_utils import Database
 from sqlite_utils.db import Table
 
@@ -6,8 +12,14 @@ from airtable_to_sqlite.constants import (
     AirtablePersonalAccessToken,
     PreferedNamingMethod,
 )
-from airtable_to_sqlite.main import AirtableBaseToSqlite, get_base_records
+from airtable_to_sqlite.converters import record_hash
+from airtable_to_sqlite.main import AirtableBaseToSqlite, export_base, get_base_records
 from airtable_to_sqlite.schema import BaseRecord
+from airtable_to_sqlite.sinks import NDJSONSink, SQLiteSink
+from airtable_to_sqlite.stats import ExportHooks
+
+from .conftest import iterate_requests
+from .dummy_returns import BASE_SCHEMA, DUMMY_RECORDS, DUMMY_RESPONSES
 
 
 def test_airtable_base_to_sqlite_get_schema(_mock_base_schema):
@@ -62,7 +74,7 @@ def test_airtable_base_to_sqlite_create_all_table_metadata(_mock_base_schema):
     assert "_id" in columns
     assert "_createdTime" in columns
     assert pks == ["_id"]
-    assert len(columns) == 5
+    assert len(columns) == 6
     assert "fld123456789C" in columns
 
     # test foreign keys have been created
@@ -72,6 +84,40 @@ def test_airtable_base_to_sqlite_create_all_table_metadata(_mock_base_schema):
     assert len(meta_table.foreign_keys) == 1
 
 
+def test_airtable_base_to_sqlite_create_foreign_keys_once_per_table(_mock_base_schema, mocker):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+    )
+    api.get_schema()
+    api.create_metadata_tables()
+    api.create_all_table_metadata()
+    foreign_keys = set(api.foreign_keys)
+    tables_with_keys = {table_name for table_name, _ in foreign_keys}
+    transform = mocker.spy(Table, "transform")
+    api.create_foreign_keys()
+
+    transformed = [call.args[0].name for call in transform.call_args_list]
+    assert sorted(transformed) == sorted(tables_with_keys)
+
+    link_table = db["tbl123_fld123456789D"]
+    assert isinstance(link_table, Table)
+    assert {(fk.column, fk.other_table) for fk in link_table.foreign_keys} == {
+        ("recordId", "tbl123"),
+        ("otherRecordId", "tbl124"),
+    }
+
+    # keys that already exist don't rebuild any tables
+    api.foreign_keys = foreign_keys
+    transform.reset_mock()
+    api.create_foreign_keys()
+    assert transform.call_count == 0
+
+
 def test_airtable_base_to_sqlite_create_all_table_metadata_prefer_name(_mock_base_schema):
     db = Database(memory=True)
     base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
@@ -94,7 +140,7 @@ def test_airtable_base_to_sqlite_create_all_table_metadata_prefer_name(_mock_bas
     assert "_id" in columns
     assert "_createdTime" in columns
     assert pks == ["_id"]
-    assert len(columns) == 5
+    assert len(columns) == 6
     assert "IP Address" in columns
 
 
@@ -117,7 +163,55 @@ def test_airtable_base_to_sqlite_insert_settings(_mock_base_schema):
 
     data = list(db["_meta_settings"].rows)
 
-    assert len(data) == 4
+    # the base, the naming method and a fingerprint of the schema and each table
+    assert len(data) == 7
+    assert {row["key"] for row in data} >= {"schema_fingerprint", "schema_fingerprint:tbl123"}
+
+
+def test_airtable_base_to_sqlite_run_stats(_mock_base_schema, _mock_api):
+    class RecordingHooks(ExportHooks):
+        def __init__(self):
+            self.calls = []
+
+        def phase_finished(self, stats, phase, seconds):  # noqa: ARG002
+            self.calls.append(("phase", phase))
+
+        def table_finished(self, stats, table_name, table_stats):  # noqa: ARG002
+            self.calls.append(("table", table_name, table_stats.records))
+
+        def export_finished(self, stats):  # noqa: ARG002
+            self.calls.append(("export",))
+
+    hooks = RecordingHooks()
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    stats = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        hooks=[hooks],
+    ).run()
+
+    assert list(stats.phases) == [
+        "get_schema",
+        "create_metadata_tables",
+        "create_all_table_metadata",
+        "create_foreign_keys",
+        "insert_settings",
+        "create_checkpoint_table",
+        "insert_all_table_data",
+        "create_indexes",
+        "remove_checkpoint_table",
+    ]
+    assert stats.records == 8
+    assert stats.tables["My Table"].records == 4
+    assert stats.tables["My Table"].link_rows == 3
+    assert stats.tables["My Other Table"].link_rows == 0
+    assert stats.seconds >= stats.phases["insert_all_table_data"]
+    assert ("table", "My Table", 4) in hooks.calls
+    assert hooks.calls[0] == ("phase", "get_schema")
+    assert hooks.calls[-1] == ("export",)
+    assert stats.as_dict()["base"] == {"id": "app123", "name": "My Base"}
 
 
 def test_airtable_base_to_sqlite_run(_mock_base_schema, _mock_api):
@@ -135,7 +229,7 @@ def test_airtable_base_to_sqlite_run(_mock_base_schema, _mock_api):
 
     data = list(db["_meta_settings"].rows)
 
-    assert len(data) == 4
+    assert len(data) == 7
 
 
 def test_get_base_records_all(_mock_get_api_bases):
@@ -155,3 +249,1004 @@ def test_get_base_records_missing(_mock_get_api_bases):
         )
     with pytest.raises(KeyError):
         list(get_base_records(personal_access_token=AirtablePersonalAccessToken("key123"), base_ids=["app456"]))
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_airtable_base_to_sqlite_insert_table_data_links(_mock_base_schema, _mock_api, batch_size):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        batch_size=batch_size,
+    )
+    api.get_schema()
+    api.create_metadata_tables()
+    api.create_all_table_metadata()
+    api.insert_table_data(api.table_meta[0])
+
+    assert db["tbl123"].count == 4
+    link_rows = list(db["tbl123_fld123456789D"].rows)
+    assert len(link_rows) == 3
+    assert {"recordId": "rec124", "otherRecordId": "rec902"} in link_rows
+    assert api._link_rows == {}
+
+
+def test_airtable_base_to_sqlite_table_plan(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.NAME,
+    )
+    api.get_schema()
+    table = api.table_meta[0]
+    plan = api.get_table_plan(table)
+    assert plan.table_name == "My Table"
+    assert plan.columns == ("_id", "_createdTime", "_hash", "Name", "Spec", "IP Address")
+    assert [field_name for field_name, _ in plan.fields] == ["Name", "Spec", "IP Address"]
+    assert [(field_name, table_name) for field_name, table_name, _ in plan.link_fields] == [
+        ("Linked record", "My Table_fld123456789D")
+    ]
+    assert api.get_table_plan(table) is plan
+
+    record = {
+        "id": "rec123",
+        "createdTime": "2021-01-01T00:00:00.000Z",
+        "fields": {"Name": "Test", "Spec": ["a", "b"], "Linked record": ["rec901"]},
+    }
+    page = api.transform_page(table, [record], None)
+    assert page.records == [
+        ("rec123", "2021-01-01T00:00:00.000Z", record_hash(record, plan.fingerprint), "Test", '["a", "b"]', None)
+    ]
+    assert page.links["My Table_fld123456789D"] == [("rec123", "rec901")]
+
+
+def test_airtable_base_to_sqlite_insert_table_data_streaming(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        batch_size=2,
+    )
+    api.get_schema()
+    api.create_metadata_tables()
+    api.create_all_table_metadata()
+
+    rows_before_page = []
+
+    def iterate_requests(**kwargs):  # noqa: ARG001
+        for response in DUMMY_RESPONSES:
+            rows_before_page.append(db["tbl123"].count)
+            yield response
+
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = iterate_requests
+    api.insert_table_data(api.table_meta[0])
+
+    # the first page is written before the second page is fetched
+    assert rows_before_page == [0, 2]
+    assert db["tbl123"].count == 4
+
+
+def test_airtable_base_to_sqlite_run_concurrently(_mock_base_schema, _mock_api):
+    results = []
+    for concurrency in (1, 4):
+        db = Database(memory=True)
+        base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+        api = AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            prefer_ids=PreferedNamingMethod.ID,
+            concurrency=concurrency,
+        )
+        api.run()
+        results.append(
+            {table_name: sorted(tuple(row.values()) for row in db[table_name].rows) for table_name in db.table_names()}
+        )
+    assert results[0] == results[1]
+    assert len(results[1]["tbl124"]) == 4
+    assert len(results[1]["tbl123_fld123456789D"]) == 3
+
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+def test_airtable_base_to_sqlite_progress_names_base(_mock_base_schema, _mock_api, capsys, concurrency):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        concurrency=concurrency,
+    ).run()
+
+    # progress bars from bases exported alongside each other can be told apart
+    progress = capsys.readouterr().err
+    assert "My Base: 100%" in progress
+    assert ("My Base: My Table: 4 records" in progress) == (concurrency == 1)
+    assert ("My Base: 8 records" in progress) == (concurrency > 1)
+
+
+def test_airtable_base_to_sqlite_run_concurrently_error(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        concurrency=2,
+    )
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = ConnectionError("Network down")
+    with pytest.raises(ConnectionError):
+        api.run()
+
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+def test_airtable_base_to_sqlite_run_incremental(_mock_base_schema, _mock_api, concurrency):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+
+    def run():
+        AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            prefer_ids=PreferedNamingMethod.ID,
+            incremental=True,
+            concurrency=concurrency,
+        ).run()
+
+    run()
+    settings = {row["key"]: row["value"] for row in db["_meta_settings"].rows}
+    assert "last_synced:tbl123" in settings
+    assert "last_synced:tbl124" in settings
+    assert db["tbl123"].count == 4
+    assert db["tbl123_fld123456789D"].count == 3
+
+    modified_record = {
+        "id": "rec124",
+        "createdTime": "2021-01-01T00:00:00.000Z",
+        "fields": {"Name": "Test 4 (updated)", "Linked record": ["rec903"]},
+    }
+    fetch_options = []
+
+    def iterate_requests(options, **kwargs):  # noqa: ARG001
+        fetch_options.append(options)
+        if "fields" in options:
+            # rec126 has been deleted
+            return [
+                {"records": [{"id": "rec123"}, {"id": "rec124"}], "offset": "itr1"},
+                {"records": [{"id": "rec125"}]},
+            ]
+        return [{"records": [modified_record]}]
+
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = iterate_requests
+    run()
+
+    assert {"formula": f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{settings['last_synced:tbl123']}'))"} in (
+        fetch_options
+    )
+    assert {"fields": ["fld123456789A"]} in fetch_options
+    assert db["tbl123"].count == 3
+    assert db["tbl123"].get("rec124")["fld123456789A"] == "Test 4 (updated)"
+    assert db["tbl123"].get("rec123")["fld123456789A"] == "Test 3"
+    assert sorted(row["otherRecordId"] for row in db["tbl123_fld123456789D"].rows) == ["rec901", "rec903"]
+    assert db["_meta_table"].count == 2
+    new_settings = {row["key"]: row["value"] for row in db["_meta_settings"].rows}
+    assert new_settings["last_synced:tbl123"] > settings["last_synced:tbl123"]
+
+
+def test_airtable_base_to_sqlite_incremental_new_column(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    db["tbl123"].create({"_id": str, "_createdTime": str}, pk="_id")
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        incremental=True,
+    ).run()
+    assert "fld123456789C" in db["tbl123"].columns_dict
+    assert db["tbl123"].count == 4
+
+
+@pytest.mark.parametrize("has_fingerprint", [True, False])
+def test_airtable_base_to_sqlite_incremental_new_table(_mock_base_schema, _mock_api, has_fingerprint):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+
+    def run():
+        AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            prefer_ids=PreferedNamingMethod.ID,
+            incremental=True,
+        ).run()
+
+    run()
+    # the table has been removed by hand
+    db["tbl123"].drop()
+    if not has_fingerprint:
+        # as in a database from before schema fingerprints were stored
+        db["_meta_settings"].delete_where("key = ?", ["schema_fingerprint"])
+    fetch_options = []
+
+    def iterate_requests(options, **kwargs):
+        fetch_options.append(options)
+        return iterate_requests_default(options=options, **kwargs)
+
+    iterate_requests_default = _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = iterate_requests
+    run()
+
+    # the table that was created again is fetched in full
+    assert ["formula" in options for options in fetch_options if "fields" not in options] == [False, True]
+    assert db["tbl123"].count == 4
+
+
+def modified_since_iterate_requests(records):
+    # like Airtable, only the first record has been modified since the last
+    # run, and the record IDs are always all returned
+    def iterate_requests(options, **kwargs):  # noqa: ARG001
+        if "fields" in options:
+            return [{"records": [{"id": record["id"]} for record in records]}]
+        if "IS_AFTER" in options.get("formula", ""):
+            return [{"records": records[:1]}]
+        return [{"records": records}]
+
+    return iterate_requests
+
+
+def test_airtable_base_to_sqlite_incremental_toggle_child_tables(mocker, _mock_api):
+    schema = copy.deepcopy(BASE_SCHEMA)
+    schema["tables"][0]["fields"].append(
+        {
+            "type": "multipleSelects",
+            "id": "fld123456789E",
+            "name": "Tags",
+            "options": {"choices": [{"id": "sel123", "name": "Urgent"}, {"id": "sel124", "name": "Later"}]},
+        }
+    )
+    mocker.patch("pyairtable.metadata.get_base_schema", return_value=schema)
+    records = [
+        {"id": f"rec12{i}", "createdTime": "2021-01-01T00:00:00.000Z", "fields": {"Tags": ["Urgent", "Later"]}}
+        for i in range(4)
+    ]
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = modified_since_iterate_requests(
+        records
+    )
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+
+    def run(*, child_tables):
+        AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            incremental=True,
+            child_tables=child_tables,
+        ).run()
+
+    run(child_tables=True)
+    assert db["My Table_fld123456789E"].count == 8
+
+    # every record gets the new column, not just the one that was modified
+    run(child_tables=False)
+    assert not db["My Table_fld123456789E"].exists()
+    assert [row["Tags"] for row in db["My Table"].rows] == ['["Urgent", "Later"]'] * 4
+
+    run(child_tables=True)
+    assert db["My Table_fld123456789E"].count == 8
+
+
+def test_airtable_base_to_sqlite_incremental_change_prefer_ids(_mock_base_schema, _mock_api):
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = modified_since_iterate_requests(
+        copy.deepcopy(DUMMY_RECORDS[0] + DUMMY_RECORDS[1])
+    )
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+
+    def run(prefer_ids):
+        AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            prefer_ids=prefer_ids,
+            incremental=True,
+        ).run()
+
+    run(PreferedNamingMethod.NAME)
+    run(PreferedNamingMethod.ID)
+
+    # the tables and columns are renamed, keeping the records that weren't
+    # fetched again
+    assert not db["My Table"].exists()
+    assert not db["My Table_fld123456789D"].exists()
+    assert db["tbl123"].count == 4
+    assert db["tbl123_fld123456789D"].count == 3
+    columns = db["tbl123"].columns_dict
+    assert "fld123456789C" in columns
+    assert "IP Address" not in columns
+    assert db["tbl123"].get("rec125")["fld123456789A"] == "Test 5"
+
+
+def test_airtable_base_to_sqlite_incremental_unchanged_records(_mock_base_schema, _mock_api, mocker):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+
+    def run():
+        return AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            prefer_ids=PreferedNamingMethod.ID,
+            incremental=True,
+        ).run()
+
+    run()
+    hashes = {row["_id"]: row["_hash"] for row in db["tbl123"].rows}
+
+    def iterate_requests(options, **kwargs):  # noqa: ARG001
+        if "fields" in options:
+            # rec126 has been deleted
+            return [{"records": [{"id": "rec123"}, {"id": "rec124"}, {"id": "rec125"}]}]
+        records = copy.deepcopy(DUMMY_RECORDS[0] + DUMMY_RECORDS[1][:1])
+        records[1]["fields"]["Linked record"] = ["rec903"]
+        return [{"records": records}]
+
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = iterate_requests
+    write_rows = mocker.spy(SQLiteSink, "write_rows")
+    stats = run()
+
+    # only the record that changed is written, along with its links
+    assert stats.tables["tbl123"].records == 1
+    assert stats.tables["tbl123"].unchanged == 2
+    assert stats.tables["tbl123"].deleted == 1
+    assert stats.tables["tbl123"].link_rows == 1
+    assert stats.as_dict()["unchanged"] == 4
+    written = [row[0] for call in write_rows.call_args_list if call.args[1] == "tbl123" for row in call.args[3]]
+    assert written == ["rec124"]
+    new_hashes = {row["_id"]: row["_hash"] for row in db["tbl123"].rows}
+    assert new_hashes["rec123"] == hashes["rec123"]
+    assert new_hashes["rec124"] != hashes["rec124"]
+    assert sorted(row["otherRecordId"] for row in db["tbl123_fld123456789D"].rows) == ["rec901", "rec903"]
+
+
+def test_airtable_base_to_sqlite_incremental_unchanged_schema(_mock_base_schema, _mock_api, mocker):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+
+    def run():
+        return AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            incremental=True,
+        ).run()
+
+    stats = run()
+    assert "create_all_table_metadata" in stats.phases
+    fingerprint = db["_meta_settings"].get("schema_fingerprint")["value"]
+
+    create_table_metadata = mocker.spy(AirtableBaseToSqlite, "create_table_metadata")
+    stats = run()
+    assert create_table_metadata.call_count == 0
+    assert "migrate_schema" in stats.phases
+    assert "create_all_table_metadata" not in stats.phases
+    assert db["_meta_settings"].get("schema_fingerprint")["value"] == fingerprint
+    assert db["_meta_table"].count == 2
+    assert db["_meta_field"].count == 5
+    assert db["_meta_field_choice"].count == 4
+
+
+def test_airtable_base_to_sqlite_incremental_migrate_schema(_mock_base_schema, _mock_api, mocker):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+
+    def run():
+        AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            incremental=True,
+        ).run()
+
+    run()
+    assert db["My Table_fld123456789D"].exists()
+
+    # a field is renamed, one is added and the link field is removed in the
+    # first table, and the second table is renamed
+    schema = copy.deepcopy(BASE_SCHEMA)
+    fields = schema["tables"][0]["fields"]
+    fields[2]["name"] = "IP"
+    fields[3] = {"type": "number", "id": "fld123456789E", "name": "Cores", "options": {"precision": 0}}
+    schema["tables"][1]["name"] = "Renamed Table"
+    mocker.patch("pyairtable.metadata.get_base_schema", return_value=schema)
+    fetch_options = []
+
+    def iterate_requests(options, **kwargs):
+        fetch_options.append(options)
+        return iterate_requests_default(options=options, **kwargs)
+
+    iterate_requests_default = _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = iterate_requests
+    migrate_table = mocker.spy(AirtableBaseToSqlite, "migrate_table")
+    run()
+
+    assert migrate_table.call_count == 2
+    columns = db["My Table"].columns_dict
+    assert "IP" in columns
+    assert "IP Address" not in columns
+    assert "Cores" in columns
+    assert db["My Table"].get("rec123")["IP"] is None
+    assert not db["My Table_fld123456789D"].exists()
+    assert db["Renamed Table"].exists()
+    assert not db["My Other Table"].exists()
+    assert {row["name"] for row in db["_meta_field"].rows_where("tableId = ?", ["tbl123"])} == {
+        "Name",
+        "Spec",
+        "IP",
+        "Cores",
+    }
+    assert db["_meta_table"].get("tbl124")["name"] == "Renamed Table"
+    # the table with a new field is fetched again in full, and the renamed
+    # table only fetches records modified since the last export
+    assert ["formula" in options for options in fetch_options if "fields" not in options] == [False, True]
+
+
+def interrupted_iterate_requests(calls):
+    # the second table fails after its first page has been fetched
+    def iterate_requests(options, **kwargs):  # noqa: ARG001
+        calls.append(options)
+        yield DUMMY_RESPONSES[0]
+        if len(calls) == 2:
+            msg = "Network down"
+            raise ConnectionError(msg)
+        yield from DUMMY_RESPONSES[1:]
+
+    return iterate_requests
+
+
+def test_airtable_base_to_sqlite_resume(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    calls = []
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = interrupted_iterate_requests(
+        calls
+    )
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        batch_size=2,
+    )
+    with pytest.raises(ConnectionError):
+        api.run()
+
+    checkpoints = {row["tableId"]: row for row in db["_meta_checkpoint"].rows}
+    assert checkpoints["tbl123"]["complete"] == 1
+    assert checkpoints["tbl124"] == {"tableId": "tbl124", "offset": "itr123/rec124", "complete": 0}
+    assert db["tbl124"].count == 2
+
+    calls.clear()
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        resume=True,
+    )
+    api.run()
+
+    # only the remaining page of the second table is fetched
+    assert calls == [{"offset": "itr123/rec124"}]
+    assert db["tbl123"].count == 4
+    assert db["tbl123_fld123456789D"].count == 3
+    assert db["tbl124"].count == 4
+    assert db["_meta_settings"].count == 7
+    assert "_meta_checkpoint" not in db.table_names()
+
+
+def test_airtable_base_to_sqlite_resume_expired_offset(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    calls = []
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = interrupted_iterate_requests(
+        calls
+    )
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        batch_size=2,
+        concurrency=2,
+    )
+    with pytest.raises(ConnectionError):
+        api.run()
+    assert db["_meta_checkpoint"].count > 0
+
+    def iterate_requests(options, **kwargs):  # noqa: ARG001
+        if "offset" in options:
+            response = requests.Response()
+            response.status_code = 422
+            raise requests.HTTPError(response=response)
+        return iter(DUMMY_RESPONSES)
+
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = iterate_requests
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        resume=True,
+        concurrency=2,
+    )
+    api.run()
+
+    assert db["tbl123"].count == 4
+    assert db["tbl123_fld123456789D"].count == 3
+    assert db["tbl124"].count == 4
+    assert "_meta_checkpoint" not in db.table_names()
+
+
+def test_airtable_base_to_sqlite_resume_without_checkpoint(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.ID,
+        resume=True,
+    )
+    api.run()
+    assert db["tbl123"].count == 4
+    assert "_meta_checkpoint" not in db.table_names()
+
+
+def test_airtable_base_to_sqlite_flush_commits_checkpoint(_mock_base_schema, _mock_api):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        seen = []
+
+        def watched_iterate_requests(options, **kwargs):  # noqa: ARG001
+            for response in DUMMY_RESPONSES:
+                # another connection only sees what has been committed
+                reader = Database(database)
+                if "tbl123" in reader.table_names():
+                    seen.append(
+                        (
+                            reader["tbl123"].count,
+                            [(row["tableId"], row["offset"]) for row in reader["_meta_checkpoint"].rows],
+                        )
+                    )
+                reader.close()
+                yield response
+
+        _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = watched_iterate_requests
+        db = Database(database)
+        api = AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            prefer_ids=PreferedNamingMethod.ID,
+            batch_size=2,
+        )
+        api.run()
+        db.close()
+
+    # the records from each page are committed along with the offset of the
+    # next page
+    assert seen == [
+        (0, []),
+        (2, [("tbl123", "itr123/rec124")]),
+        (4, [("tbl123", None)]),
+        (4, [("tbl123", None), ("tbl124", "itr123/rec124")]),
+    ]
+
+
+def test_airtable_base_to_sqlite_flush_error(_mock_base_schema, _mock_api, mocker):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        db = Database(database)
+        AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            prefer_ids=PreferedNamingMethod.NAME,
+            incremental=True,
+        ).run()
+        last_synced = db["_meta_settings"].get("last_synced:tbl123")["value"]
+
+        # a record with links is changed, so its old link rows are deleted
+        # before the new ones are written
+        responses = copy.deepcopy(DUMMY_RESPONSES)
+        responses[0]["records"][1]["fields"]["Name"] = "Changed"
+
+        def changed_iterate_requests(options, **kwargs):  # noqa: ARG001
+            return iter(responses)
+
+        _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = changed_iterate_requests
+        api = AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            prefer_ids=PreferedNamingMethod.NAME,
+            incremental=True,
+        )
+        save_checkpoints = api.save_checkpoints
+        msg = "Disk full"
+
+        def failing_save_checkpoints(*, complete=False):
+            # fails once the table's records, checkpoint and sync time have
+            # all been written
+            save_checkpoints(complete=complete)
+            if complete:
+                raise OSError(msg)
+
+        mocker.patch.object(api, "save_checkpoints", side_effect=failing_save_checkpoints)
+        with pytest.raises(OSError, match=msg):
+            api.run()
+        db.close()
+
+        # everything written when the table was finished is rolled back
+        db = Database(database)
+        assert db["My Table"].get("rec124")["Name"] == "Test 4"
+        assert db["My Table_fld123456789D"].count == 3
+        assert db["_meta_settings"].get("last_synced:tbl123")["value"] == last_synced
+        assert db["_meta_checkpoint"].count == 0
+        db.close()
+
+
+def test_export_base_resume(_mock_base_schema, _mock_api):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    calls = []
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = interrupted_iterate_requests(
+        calls
+    )
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        with pytest.raises(ConnectionError):
+            export_base(AirtablePersonalAccessToken("key123"), base, database, batch_size=1)
+
+        export_base(AirtablePersonalAccessToken("key123"), base, database, resume=True)
+        db = Database(database)
+        assert db["My Other Table"].count == 4
+        assert "_meta_checkpoint" not in db.table_names()
+        db.close()
+
+        # resuming a complete export starts again from scratch
+        export_base(AirtablePersonalAccessToken("key123"), base, database, resume=True)
+        db = Database(database)
+        assert db["My Other Table"].count == 4
+        db.close()
+
+
+def test_export_base_bulk_load(_mock_base_schema, _mock_api):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        export_base(AirtablePersonalAccessToken("key123"), base, database, bulk_load=True, batch_size=1)
+        assert not os.path.exists(database + "-wal")
+        db = Database(database)
+        assert db.journal_mode == "delete"
+        assert db["My Table"].count == 4
+        assert "_meta_checkpoint" not in db.table_names()
+        db.close()
+
+
+def test_export_base_bulk_load_error(_mock_base_schema, _mock_api):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = interrupted_iterate_requests([])
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        with pytest.raises(ConnectionError):
+            export_base(AirtablePersonalAccessToken("key123"), base, database, bulk_load=True, batch_size=1)
+
+        # nothing is saved from a failed bulk load
+        db = Database(database)
+        assert db.table_names() == []
+        db.close()
+
+
+def test_export_base_atomic_write(_mock_base_schema, _mock_api):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        Database(database)["existing"].insert({"id": 1})
+        seen = []
+
+        def watched_iterate_requests(options, **kwargs):  # noqa: ARG001
+            # the output file is untouched while the export is running
+            seen.append(Database(database).table_names())
+            yield from DUMMY_RESPONSES
+
+        _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = watched_iterate_requests
+        export_base(AirtablePersonalAccessToken("key123"), base, database, atomic_write=True)
+
+        assert seen == [["existing"], ["existing"]]
+        assert not os.path.exists(database + ".tmp")
+        db = Database(database)
+        assert "existing" not in db.table_names()
+        assert db["My Table"].count == 4
+        db.close()
+
+
+def test_export_base_atomic_write_incremental(_mock_base_schema, _mock_api):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        export_base(AirtablePersonalAccessToken("key123"), base, database)
+        Database(database)["My Table"].insert({"_id": "rec999"})
+
+        export_base(AirtablePersonalAccessToken("key123"), base, database, incremental=True, atomic_write=True)
+        db = Database(database)
+        # the existing data was carried over, and deleted records removed
+        assert db["_meta_settings"].get("last_synced:tbl123")
+        assert db["My Table"].count == 4
+        db.close()
+
+
+def test_export_base_atomic_write_resume(_mock_base_schema, _mock_api):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = interrupted_iterate_requests([])
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        with pytest.raises(ConnectionError):
+            export_base(AirtablePersonalAccessToken("key123"), base, database, atomic_write=True, batch_size=1)
+        assert not os.path.exists(database)
+        assert os.path.exists(database + ".tmp")
+
+        _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = iterate_requests
+        export_base(AirtablePersonalAccessToken("key123"), base, database, atomic_write=True, resume=True)
+        assert not os.path.exists(database + ".tmp")
+        db = Database(database)
+        assert db["My Other Table"].count == 4
+        db.close()
+
+
+def test_export_base_optimize(_mock_base_schema, _mock_api):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        database = os.path.join(tmpdirname, "base.db")
+        export_base(AirtablePersonalAccessToken("key123"), base, database, optimize=True)
+        db = Database(database)
+        assert "sqlite_stat1" in db.table_names()
+        db.close()
+
+
+def test_airtable_base_to_sqlite_create_indexes(_mock_base_schema, _mock_api):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.NAME,
+        index_fields=[("My Table", "IP Address"), ("tbl123", "fld123456789A"), ("Missing", "Field")],
+    )
+    api.run()
+
+    link_table = db["My Table_fld123456789D"]
+    assert isinstance(link_table, Table)
+    assert {tuple(index.columns) for index in link_table.indexes} == {("recordId",), ("otherRecordId",)}
+
+    meta_field = db["_meta_field"]
+    assert isinstance(meta_field, Table)
+    assert ("tableId",) in {tuple(index.columns) for index in meta_field.indexes}
+
+    data_table = db["My Table"]
+    assert isinstance(data_table, Table)
+    assert {tuple(index.columns) for index in data_table.indexes} == {("IP Address",), ("Name",), ("_id",)}
+
+
+def test_airtable_base_to_sqlite_child_tables(mocker, _mock_api):
+    schema = copy.deepcopy(BASE_SCHEMA)
+    schema["tables"][0]["fields"] += [
+        {
+            "type": "multipleSelects",
+            "id": "fld123456789E",
+            "name": "Tags",
+            "options": {"choices": [{"id": "sel123", "name": "Urgent"}, {"id": "sel124", "name": "Later"}]},
+        },
+        {"type": "multipleAttachments", "id": "fld123456789F", "name": "Files"},
+        {"type": "multipleCollaborators", "id": "fld123456789G", "name": "People"},
+    ]
+    mocker.patch("pyairtable.metadata.get_base_schema", return_value=schema)
+    record = {
+        "id": "rec123",
+        "createdTime": "2021-01-01T00:00:00.000Z",
+        "fields": {
+            "Name": "Test",
+            "Tags": ["Urgent", "Later"],
+            "Files": [{"id": "att123", "url": "https://example.com/a.png", "filename": "a.png", "size": 10}],
+            "People": [{"id": "usr123", "email": "a@example.com", "name": "A"}],
+        },
+    }
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.return_value = [{"records": [record]}]
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = None
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.NAME,
+        child_tables=True,
+    )
+    api.run()
+
+    columns = [c.name for c in db["My Table"].columns]
+    assert "Tags" not in columns
+    assert "Files" not in columns
+    assert list(db["My Table_fld123456789E"].rows) == [
+        {"recordId": "rec123", "choiceId": "sel123", "name": "Urgent"},
+        {"recordId": "rec123", "choiceId": "sel124", "name": "Later"},
+    ]
+    attachments = list(db["My Table_fld123456789F"].rows)
+    assert len(attachments) == 1
+    assert attachments[0]["id"] == "att123"
+    assert attachments[0]["size"] == 10
+    assert list(db["My Table_fld123456789G"].rows) == [
+        {"recordId": "rec123", "id": "usr123", "email": "a@example.com", "name": "A"}
+    ]
+    tags_table = db["My Table_fld123456789E"]
+    assert isinstance(tags_table, Table)
+    assert {(fk.column, fk.other_table) for fk in tags_table.foreign_keys} == {
+        ("recordId", "My Table"),
+        ("choiceId", "_meta_field_choice"),
+    }
+
+
+def test_airtable_base_to_sqlite_partial_export(_mock_base_schema, _mock_api):
+    calls = []
+
+    def recording_iterate_requests(options, **kwargs):
+        calls.append(options)
+        return iterate_requests(options=options, **kwargs)
+
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = recording_iterate_requests
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        prefer_ids=PreferedNamingMethod.NAME,
+        only_tables=["My Table"],
+        only_fields=[("tbl123", "Name"), ("My Table", "fld123456789D")],
+        views=[("My Table", "Grid view")],
+        formulas=[("tbl123", "{Name} != ''")],
+    )
+    api.run()
+
+    assert calls == [{"fields": ["fld123456789A", "fld123456789D"], "view": "Grid view", "formula": "{Name} != ''"}]
+    assert "My Other Table" not in db.table_names()
+    assert [c.name for c in db["My Table"].columns] == ["_id", "_createdTime", "_hash", "Name"]
+    assert db["My Table_fld123456789D"].count == 3
+    assert api.get_fetch_options(api.table_meta[0]) == calls[0]
+
+    api.incremental = True
+    db["_meta_settings"].insert_all(
+        [
+            {"key": "last_synced:tbl123", "value": "2023-01-01T00:00:00+00:00"},
+            {"key": "filters:tbl123", "value": '{"formula": "{Name} != \'\'", "view": "Grid view"}'},
+        ],
+        replace=True,
+    )
+    assert api.get_fetch_options(api.table_meta[0])["formula"].startswith("AND({Name} != '', IS_AFTER(")
+    api.get_record_ids(api.table_meta[0])
+    assert calls[-1] == {"fields": ["fld123456789A"], "view": "Grid view", "formula": "{Name} != ''"}
+
+
+def test_airtable_base_to_sqlite_incremental_change_filters(_mock_base_schema, _mock_api):
+    records = [
+        {"id": "recA", "createdTime": "2021-01-01T00:00:00.000Z", "fields": {"Name": "open"}},
+        {"id": "recB", "createdTime": "2021-01-01T00:00:00.000Z", "fields": {"Name": "closed"}},
+    ]
+
+    def filtered_iterate_requests(options, **kwargs):  # noqa: ARG001
+        # no records have been modified since the last run
+        if "IS_AFTER" in options.get("formula", ""):
+            return [{"records": []}]
+        matching = [r for r in records if "open" not in options.get("formula", "") or r["fields"]["Name"] == "open"]
+        return [{"records": matching}]
+
+    _mock_api.base.return_value.table.return_value.api.iterate_requests.side_effect = filtered_iterate_requests
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    runs = [([("tbl123", "{Name}='open'")], {"formula": "{Name}='open'"}), ([], {})]
+    for formulas, filters in runs:
+        AirtableBaseToSqlite(
+            personal_access_token=AirtablePersonalAccessToken("key123"),
+            db=db,
+            base=base,
+            prefer_ids=PreferedNamingMethod.ID,
+            incremental=True,
+            formulas=formulas,
+        ).run()
+        assert db["_meta_settings"].get("filters:tbl123")["value"] == json.dumps(filters)
+
+    # records that didn't match the old formula are fetched, even though
+    # they haven't been modified
+    assert {row["_id"] for row in db["tbl123"].rows} == {"recA", "recB"}
+
+
+def test_airtable_base_to_sqlite_unmatched_filters(_mock_base_schema, _mock_api, caplog):
+    db = Database(memory=True)
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    api = AirtableBaseToSqlite(
+        personal_access_token=AirtablePersonalAccessToken("key123"),
+        db=db,
+        base=base,
+        only_tables=["My Table", "My Tabel"],
+        only_fields=[("My Table", "Nmae"), ("My Other Table", "Name")],
+        views=[("My Tabel", "Grid view")],
+    )
+    api.get_schema()
+
+    warnings = [record.getMessage() for record in caplog.records if record.levelname == "WARNING"]
+    assert warnings == [
+        "Not exporting My Table.Nmae as it isn't in base app123",
+        "Not exporting table My Tabel as it isn't in base app123",
+        "Ignoring field Name for table My Other Table as it isn't exported from base app123",
+        "Ignoring view Grid view for table My Tabel as it isn't exported from base app123",
+    ]
+    # an empty list of fields would make Airtable return all of them
+    assert api.table_meta[0].fields == []
+    assert api.get_fetch_options(api.table_meta[0]) == {"fields": ["fld123456789A"]}
+
+
+@pytest.mark.parametrize("output_format", ["ndjson", "csv"])
+def test_export_base_file_sink(_mock_base_schema, _mock_api, output_format):
+    base = BaseRecord(id="app123", name="My Base", permissionLevel="create")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = os.path.join(tmpdirname, "export")
+        stats = export_base(
+            AirtablePersonalAccessToken("key123"), base, output, output_format=output_format, concurrency=2
+        )
+        files = set(os.listdir(output))
+        with open(os.path.join(output, "My Table." + output_format), encoding="utf8") as f:
+            lines = f.read().splitlines()
+    assert files == {
+        f"{name}.{output_format}"
+        for name in [
+            "My Table",
+            "My Other Table",
+            "My Table_fld123456789D",
+            "_meta_table",
+            "_meta_field",
+            "_meta_field_choice",
+            "_meta_view",
+            "_meta_settings",
+        ]
+    }
+    # a header row is included in the CSV files
+    assert len(lines) == (5 if output_format == "csv" else 4)
+    assert stats.records == 8
+    assert "create_foreign_keys" not in stats.phases
+
+
+def test_airtable_base_to_sqlite_file_sink_incremental():
+    with tempfile.TemporaryDirectory() as tmpdirname, pytest.raises(ValueError, match="only possible"):
+        AirtableBaseToSqlite(
+            AirtablePersonalAccessToken("key123"),
+            Database(memory=True),
+            BaseRecord(id="app123", name="My Base", permissionLevel="create"),
+            incremental=True,
+            sink=NDJSONSink(tmpdirname),
+        )
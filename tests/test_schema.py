@@ -28,6 +28,20 @@ def test_fieldschema_column_type():
     )
 
 
+def test_fieldschema_converter():
+    assert FieldSchema(id="fld123", name="Name", type="multipleSelects").column_type is list
+    assert FieldSchema(id="fld123", name="Name", type="multipleSelects").converter(["a", "b"]) == '["a", "b"]'
+    assert FieldSchema(id="fld123", name="Name", type="singleCollaborator").converter({"id": "usr123"}) == (
+        '{"id": "usr123"}'
+    )
+    assert FieldSchema(id="fld123", name="Name", type="text").converter("a") == "a"
+    rollup = FieldSchema(id="fld123", name="Name", type="rollup", options={"result": {"type": "number"}})
+    assert rollup.column_type is float
+    assert rollup.converter(1.5) == 1.5
+    formula = FieldSchema(id="fld123", name="Name", type="formula", options={"result": {"type": "number"}})
+    assert formula.converter({"error": "#ERROR!"}) == '{"error": "#ERROR!"}'
+
+
 def test_fieldschema_choices():
     assert FieldSchema(id="fld123", name="Name", type="text").choices is None
     assert FieldSchema(id="fld123", name="Name", type="number").choices is None
@@ -167,3 +181,27 @@ def test_baserecord():
         permissionLevel="create",
     )
     assert b.id == "app123"
+
+
+def test_tableschema_get_record_ids(_mock_base):
+    t = TableSchema(id="tbl123", name="Table", fields=[], views=[], primaryFieldId="fld123")
+
+    assert t.get_record_ids(_mock_base) == {"rec123", "rec124", "rec125", "rec126"}
+    assert _mock_base.table.return_value.api.iterate_requests.call_args.kwargs["options"] == {"fields": ["fld123"]}
+
+
+def test_tableschema_iterate_pages(_mock_base):
+    t = TableSchema(id="tbl123", name="Table", fields=[], views=[], primaryFieldId="fld123")
+
+    pages = list(t.iterate_pages(_mock_base))
+    assert [offset for _, offset in pages] == ["itr123/rec124", None]
+
+    pages = list(t.iterate_pages(_mock_base, offset="itr123/rec124", view="Grid view"))
+    assert len(pages) == 1
+    assert pages[0][0][0]["id"] == "rec125"
+    assert _mock_base.table.return_value.api.iterate_requests.call_args.kwargs["options"] == {
+        "offset": "itr123/rec124",
+        "view": "Grid view",
+    }
+    # tables are fetched by ID, so renaming them doesn't break an export
+    _mock_base.table.assert_called_with("tbl123")
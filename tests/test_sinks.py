@@ -0,0 +1,85 @@
+import csv
+import json
+import os
+import tempfile
+
+import pytest
+from sqlite_utils import Database
+
+from airtable_to_sqlite.sinks import CSVSink, NDJSONSink, Sink, SQLiteSink, insert_sql
+
+
+def test_insert_sql():
+    assert insert_sql('My "Table"', ["_id", "Name"]) == 'INSERT INTO "My ""Table""" ("_id", "Name") VALUES (?, ?)'
+    assert insert_sql("t", ["a"], replace=True) == 'INSERT OR REPLACE INTO "t" ("a") VALUES (?)'
+
+
+def test_sqlite_sink():
+    db = Database(memory=True)
+    sink = SQLiteSink(db)
+    sink.create_table("My Table", {"_id": str, "Name": str}, pk="_id")
+    sink.write_rows("My Table", ["_id", "Name"], [("rec1", "A"), ("rec2", "B")])
+    sink.write_rows("My Table", ["_id", "Name"], [("rec1", "C")], replace=True)
+    # creating the table again adds any new columns
+    sink.create_table("My Table", {"_id": str, "Name": str, "Number": float}, pk="_id")
+    sink.finalize()
+    assert sink.database is db
+    assert list(db["My Table"].rows) == [
+        {"_id": "rec2", "Name": "B", "Number": None},
+        {"_id": "rec1", "Name": "C", "Number": None},
+    ]
+
+
+def test_ndjson_sink():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        sink = NDJSONSink(os.path.join(tmpdirname, "out"))
+        sink.create_table("Table/1", {"_id": str, "Name": str, "Done": bool})
+        sink.write_rows("Table/1", ["_id", "Name", "Done"], [("rec1", "Café", True)])
+        sink.write_rows("Table/1", ["_id", "Name", "Done"], [("rec2", None, False)])
+        sink.finalize()
+        assert sink.database is None
+        with open(os.path.join(tmpdirname, "out", "Table_1.ndjson"), encoding="utf8") as f:
+            rows = [json.loads(line) for line in f]
+    assert rows == [
+        {"_id": "rec1", "Name": "Café", "Done": True},
+        {"_id": "rec2", "Name": None, "Done": False},
+    ]
+
+
+def test_csv_sink():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        sink = CSVSink(tmpdirname)
+        sink.create_table("My Table", {"_id": str, "Name": str, "Tags": list})
+        sink.write_rows("My Table", ["_id", "Name", "Tags"], [("rec1", "A, B", '["x"]')])
+        # columns in a different order are matched to the header
+        sink.write_rows("My Table", ["Name", "_id"], [("C", "rec2")])
+        sink.finalize()
+        with open(os.path.join(tmpdirname, "My Table.csv"), encoding="utf8", newline="") as f:
+            rows = list(csv.reader(f))
+    assert rows == [["_id", "Name", "Tags"], ["rec1", "A, B", '["x"]'], ["rec2", "C", ""]]
+
+
+def test_file_sink_needs_table():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        sink = NDJSONSink(tmpdirname)
+        with pytest.raises(KeyError):
+            sink.write_rows("Missing", ["_id"], [("rec1",)])
+
+
+def test_sink_is_abstract():
+    with pytest.raises(TypeError):
+        Sink()  # type: ignore[abstract]
+
+
+def test_file_sink_file_names_are_unique():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        sink = NDJSONSink(tmpdirname)
+        for table_name in ["A/B", "A_B", "a_b"]:
+            sink.create_table(table_name, {"_id": str})
+            sink.write_rows(table_name, ["_id"], [(table_name,)])
+        sink.finalize()
+        files = {}
+        for file_name in os.listdir(tmpdirname):
+            with open(os.path.join(tmpdirname, file_name), encoding="utf8") as f:
+                files[file_name] = json.loads(f.read())["_id"]
+    assert files == {"A_B.ndjson": "A/B", "A_B_2.ndjson": "A_B", "a_b_3.ndjson": "a_b"}
@@ -0,0 +1,57 @@
+import time
+
+from airtable_to_sqlite.api import RequestMetrics
+from airtable_to_sqlite.stats import ExportHooks, ExportStats, peak_rss
+
+
+def test_export_stats():
+    metrics = RequestMetrics()
+    metrics.record_request("app123")
+    metrics.record_request("app456")
+    stats = ExportStats("app123", "My Base", request_metrics=metrics)
+    with stats.phase("insert_all_table_data"):
+        stats.table_started("My Table")
+        time.sleep(0.01)
+        stats.add_records("My Table", 10)
+        stats.add_records("My Table", 5)
+        stats.add_link_rows("My Table", 3)
+        stats.add_unchanged("My Table", 2)
+        stats.add_deleted("My Table", 1)
+        stats.table_finished("My Table")
+    stats.finish()
+
+    assert stats.phases["insert_all_table_data"] >= 0.01
+    assert stats.tables["My Table"].seconds >= 0.01
+    assert stats.records == 15
+    assert stats.link_rows == 3
+    assert stats.unchanged == 2
+    assert stats.deleted == 1
+    result = stats.as_dict()
+    assert result["tables"]["My Table"]["records"] == 15
+    assert "started" not in result["tables"]["My Table"]
+    assert result["requests"] == {"requests": 1, "bytes": 0, "retries": {}}
+    assert result["records_per_second"] > 0
+    assert result["peak_rss"] == peak_rss()
+
+
+def test_export_stats_without_metrics():
+    stats = ExportStats("app123", "My Base")
+    assert stats.as_dict()["requests"] == {}
+    assert stats.as_dict()["records_per_second"] is None
+
+
+def test_export_hooks_called_on_error():
+    phases = []
+
+    class Hooks(ExportHooks):
+        def phase_finished(self, stats, phase, seconds):  # noqa: ARG002
+            phases.append(phase)
+
+    stats = ExportStats("app123", "My Base", hooks=[Hooks()])
+    try:
+        with stats.phase("get_schema"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert "get_schema" in stats.phases
+    assert phases == []